@@ -0,0 +1,351 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import clean
+import pages
+import plots
+import validate
+
+# Times the stages of the build (cleaning, charts for each year and the pages) and
+# records the results under benchmarks/, one JSON file per commit:
+#     python src/benchmark.py
+#     python src/benchmark.py --compare <commit>
+
+src_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(src_dir)
+results_dir = os.path.join(repo_dir, "benchmarks")
+
+# Cleaners measured, and whose tables are reported by memory size
+cleaners = [
+    clean.clean_total_stock,
+    clean.clean_area_stock,
+    clean.clean_estimates,
+    clean.clean_region_stock,
+    clean.clean_sex_stock,
+    clean.clean_growth_metrics,
+    clean.clean_flow_totals,
+    validate.stock_anomalies,
+]
+
+
+def git_commit():
+    """
+    Identifies the commit being measured.
+
+    Returns:
+        tuple: The hash of HEAD and whether the working tree has uncommitted changes.
+    """
+    run = lambda *args: subprocess.run(
+        ["git", *args], cwd=repo_dir, capture_output=True, text=True
+    ).stdout.strip()
+    return run("rev-parse", "HEAD"), bool(run("status", "--porcelain", "--", "src"))
+
+
+def measure(function, repeat=3, setup=None):
+    """
+    Times a function and records its peak memory allocation.
+
+    The function is timed repeat times without tracing, keeping the fastest run, and then
+    run once more under tracemalloc, which slows it down, to measure the peak memory.
+
+    Args:
+        function (callable): The code to measure, called without arguments.
+        repeat (int): The number of timed runs. Defaults to 3.
+        setup (callable, optional): Called before every run and not timed (e.g., to clear
+                                    a cache).
+
+    Returns:
+        dict: The fastest time ('seconds'), every run ('runs') and the peak memory
+              allocated by Python in bytes ('peak_memory').
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(runs), "runs": runs, "peak_memory": peak}
+
+
+def clear_parsed_workbooks():
+    """Forgets the parsed Excel sheets, so cleaners parse the workbooks again."""
+    clean._raw_tables.clear()
+
+
+def benchmarks():
+    """
+    Lists the benchmarks of the build, in the order they run.
+
+    Cleaners are measured without their on-disk cache, once parsing the workbooks and once
+    reusing the parse. Charts are measured for each year from cleaned tables and as a single
+    specification of all years, and the pages are saved from scratch into a temporary
+    directory.
+
+    Returns:
+        dict: The function to measure and its setup (or None), keyed by benchmark name.
+    """
+    cases = {}
+    for table in cleaners:
+        name = table.__name__
+        cases[name] = (table.uncached, clear_parsed_workbooks)
+        cases[f"{name} (parsed)"] = (table.uncached, None)
+        cases[f"{name} (cached)"] = (table, None)
+    for year in plots.YEARS:
+        cases[f"migration_flow {year}"] = (
+            lambda year=year: plots.migration_flow(year),
+            None,
+        )
+        cases[f"migration_rate {year}"] = (
+            lambda year=year: plots.migration_rate(year),
+            None,
+        )
+    cases["validate"] = (validate.validate, None)
+    cases["migration_flow single"] = (
+        lambda: plots.migration_flow(all_years=True),
+        None,
+    )
+    cases["migration_rate single"] = (
+        lambda: plots.migration_rate(all_years=True),
+        None,
+    )
+    cases["pages"] = (lambda: pages.build(["country", "region"], force=True), None)
+    return cases
+
+
+def output_sizes(directory):
+    """
+    Reports the size of the files written to the pages directory.
+
+    Args:
+        directory (str): The directory of the pages.
+
+    Returns:
+        dict: The size in bytes of each page, of the shared data files and in total.
+    """
+    sizes = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            sizes[os.path.relpath(path, directory)] = os.path.getsize(path)
+    sizes = dict(sorted(sizes.items()))
+    sizes["Total"] = sum(sizes.values())
+    return sizes
+
+
+def table_sizes():
+    """
+    Reports the memory held by each cleaned table, as loaded from the on-disk cache.
+
+    Returns:
+        dict: The size in bytes of each table, keyed by cleaner name, and in total.
+    """
+    sizes = {
+        cleaner.__name__: int(clean.memory_footprint(cleaner())["Total"])
+        for cleaner in cleaners
+    }
+    sizes["Total"] = sum(sizes.values())
+    return sizes
+
+
+def run(repeat=3, names=None):
+    """
+    Runs the benchmarks against the data files configured in clean.py.
+
+    The pages, their specifications, the cleaned tables and the validation report are
+    written to a temporary directory, so the benchmark does not touch www/, data/cache/
+    or the build manifest.
+
+    Args:
+        repeat (int): The number of timed runs of each benchmark. Defaults to 3.
+        names (list, optional): Run only the benchmarks whose name starts with one of
+                                these. Defaults to all benchmarks.
+
+    Returns:
+        dict: The results, with the commit, environment, benchmarks, output sizes and
+              table sizes.
+    """
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "benchmarks": {},
+        "outputs": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        clean.cache_dir = pages.cache_dir = os.path.join(directory, "cache")
+        pages.www_dir = os.path.join(directory, "www")
+        pages.shared_data_dir = os.path.join(pages.www_dir, "data")
+        pages.specs_dir = os.path.join(directory, "specs")
+        pages.manifest_path = os.path.join(directory, "build-manifest.json")
+
+        # Also fills the cache read by the "(cached)" benchmarks
+        results["tables"] = table_sizes()
+
+        for name, (function, setup) in benchmarks().items():
+            if names and not any(name.startswith(prefix) for prefix in names):
+                continue
+            print(f"{name:<40}", end="", flush=True)
+            result = measure(function, repeat=repeat, setup=setup)
+            results["benchmarks"][name] = result
+            print(
+                f"{result['seconds']:>9.3f} s"
+                f"{result['peak_memory'] / 2**20:>10.1f} MiB"
+            )
+        if os.path.isdir(pages.www_dir):
+            results["outputs"] = output_sizes(pages.www_dir)
+    return results
+
+
+def save_results(results):
+    """
+    Saves results as benchmarks/<commit>.json (suffixed with -dirty for uncommitted code).
+
+    Args:
+        results (dict): The results of run.
+
+    Returns:
+        str: The location of the JSON file.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    name = results["commit"][:12] + ("-dirty" if results["dirty"] else "")
+    path = os.path.join(results_dir, f"{name}.json")
+    with open(path, mode="w") as file:
+        json.dump(results, file, indent=2)
+    return path
+
+
+def load_results(commit):
+    """
+    Loads the results saved for a commit.
+
+    Args:
+        commit (str): A commit hash, a prefix of one, or a path to a results file.
+
+    Returns:
+        dict: The saved results.
+    """
+    if os.path.exists(commit):
+        path = commit
+    else:
+        matches = sorted(
+            filename
+            for filename in os.listdir(results_dir)
+            if filename.startswith(commit[:12]) and filename.endswith(".json")
+        )
+        if not matches:
+            raise FileNotFoundError(f"No benchmark results for {commit}")
+        path = os.path.join(results_dir, matches[0])
+    with open(path, mode="r") as file:
+        return json.load(file)
+
+
+def compare(baseline, results, threshold=1.25):
+    """
+    Prints the change of each benchmark, output size and table size against a baseline.
+
+    Args:
+        baseline (dict): Earlier results.
+        results (dict): Current results.
+        threshold (float): The ratio of time, peak memory or size above which a change is
+                           reported as a regression. Defaults to 1.25.
+
+    Returns:
+        list: The names of the regressed benchmarks, outputs and tables.
+    """
+    regressions = []
+
+    def row(name, before, after, unit, scale):
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(
+            f"{name:<48}{before / scale:>10.3f}{after / scale:>10.3f} {unit:<4}"
+            f"{ratio:>7.2f}x{flag}"
+        )
+
+    print(f"Baseline {baseline['commit'][:12]}, current {results['commit'][:12]}")
+    for name, result in results["benchmarks"].items():
+        if name in baseline["benchmarks"]:
+            before = baseline["benchmarks"][name]
+            row(name, before["seconds"], result["seconds"], "s", 1)
+            row(
+                f"{name} [memory]",
+                before["peak_memory"],
+                result["peak_memory"],
+                "MiB",
+                2**20,
+            )
+    for name, size in results["outputs"].items():
+        if name in baseline["outputs"]:
+            row(name, baseline["outputs"][name], size, "KiB", 2**10)
+    # Results saved before the table sizes were recorded have none
+    for name, size in results["tables"].items():
+        if name in baseline.get("tables", {}):
+            row(f"{name} [table]", baseline["tables"][name], size, "KiB", 2**10)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the clean, plot and page stages of the build."
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        metavar="benchmark",
+        help="Run only the benchmarks starting with these names (default: all).",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of timed runs of each benchmark (default: 3).",
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="COMMIT",
+        help="Compare with the results saved for this commit.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Ratio above which a change is a regression (default: 1.25).",
+    )
+    args = parser.parse_args()
+
+    baseline = load_results(args.compare) if args.compare else None
+    results = run(repeat=args.repeat, names=args.benchmarks)
+    print(f"Results saved to {save_results(results)}")
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            parser.exit(1, f"{len(regressions)} regressions\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,626 @@
 import pandas as pd
 import numpy as np
-import csv
+import config
+import functools
+import hashlib
+import inspect
+import os
+import tracing
 
-countries_data = "/Users/paulacadena/Git-Hub/CAPP30239-IP/data/country-coord.csv"
-stock_data = "/Users/paulacadena/Git-Hub/CAPP30239-IP/data/undesa_pd_2020_ims_stock_by_sex_destination_and_origin.xlsx"
-estimates_data = "/Users/paulacadena/Git-Hub/CAPP30239-IP/data/WPP2024_GEN_F01_DEMOGRAPHIC_INDICATORS_COMPACT.xlsx"
+countries_data = config.data_path("country-coord.csv")
+stock_data = config.data_path(
+    "undesa_pd_2020_ims_stock_by_sex_destination_and_origin.xlsx"
+)
+estimates_data = config.data_path("WPP2024_GEN_F01_DEMOGRAPHIC_INDICATORS_COMPACT.xlsx")
+aggregates_data = config.data_path("aggregates_correspondence_table_2020_1.xlsx")
+flows_data = config.data_path("undesa_pd_2015_migration_flow_totals.xlsx")
+cache_dir = config.cache_dir
 
+# Build clean_total_stock and clean_sex_stock by streaming the stock workbook (see
+# iter_stock_rows) instead of parsing the whole sheet, trading speed for a bounded peak
+# memory. Set with MIGRATION_STREAM=1 (or pages.py --stream), so worker processes follow.
+STREAM_VARIABLE = "MIGRATION_STREAM"
+streaming = bool(os.environ.get(STREAM_VARIABLE))
 
+
+def enable_streaming():
+    """Builds the stock tables by streaming, in this process and the workers it starts."""
+    global streaming
+    streaming = True
+    os.environ[STREAM_VARIABLE] = "1"
+
+
+# Origin code used by the stock data for migrants from other or unknown countries
+OTHER_ORIGIN = 2003
+
+# Years available in the migration stock data, the columns of both sexes in "Table 1"
+YEARS = [1990, 1995, 2000, 2005, 2010, 2015, 2020]
+# Sexes in the order of their blocks of columns, which follow those of both sexes
+SEXES = ["Male", "Female"]
+
+
+def sex_columns(years=YEARS):
+    """
+    Returns the columns of the stock sheet holding the stock of each sex.
+
+    The parsed sheet names them after the year, numbered by block ("1990.1" for male,
+    "1990.2" for female), as the header repeats the years of both sexes.
+
+    Args:
+        years (list): The years of the columns. Defaults to YEARS.
+
+    Returns:
+        dict: The column names of each sex, keyed by sex in the order of SEXES.
+    """
+    return {
+        sex: [f"{year}.{number}" for year in years]
+        for number, sex in enumerate(SEXES, start=1)
+    }
+
+
+# Parsed workbooks, keyed on (path, modification time, sheet, skipped rows)
+_raw_tables = {}
+
+
+def read_raw_table(path, sheet_name, skiprows, keep_default_na=True):
+    """
+    Reads an Excel sheet once per process and shares the parsed frame between cleaners.
+
+    The sheet is parsed with placeholder values (e.g., "..") already replaced with NaN. The
+    result is cached on the file path and its modification time, so editing the workbook
+    triggers a fresh parse while repeated calls reuse the frame in memory.
+
+    Args:
+        path (str): Location of the Excel file.
+        sheet_name (str): Name of the sheet to read.
+        skiprows (int): Number of rows to skip before the header row.
+        keep_default_na (bool): Whether strings such as "NA" or "n/a" are also read as
+                                NaN, as pandas does by default. Defaults to True.
+
+    Returns:
+        pd.DataFrame: The raw sheet. Callers must not modify it in place.
+    """
+    key = (path, os.path.getmtime(path), sheet_name, skiprows, keep_default_na)
+    if key not in _raw_tables:
+        # Drop parses of older versions of the same sheet
+        for stale in [k for k in _raw_tables if k[0] == path and k[2:] == key[2:]]:
+            del _raw_tables[stale]
+        with tracing.stage("excel parse", sheet=sheet_name) as record:
+            table = pd.read_excel(
+                path,
+                sheet_name=sheet_name,
+                skiprows=skiprows,
+                header=0,
+                keep_default_na=keep_default_na,
+                na_values=None if keep_default_na else [""],
+            )
+            record["rows"] = len(table)
+        # Correctly name missing values
+        with tracing.stage("replace", sheet=sheet_name):
+            table.replace("..", np.nan, inplace=True)
+        _raw_tables[key] = table
+    return _raw_tables[key]
+
+
+def read_stock_table():
+    """
+    Returns the raw migration stock sheet ("Table 1"), parsed at most once per process.
+
+    Only empty cells and ".." are read as missing, as when streaming the sheet (see
+    iter_stock_rows), so other text is left for the cleaners to coerce and for the
+    validation to count.
+
+    Returns:
+        pd.DataFrame: The raw stock sheet shared by all stock cleaners.
+    """
+    return read_raw_table(
+        stock_data, sheet_name="Table 1", skiprows=10, keep_default_na=False
+    )
+
+
+# File hashes, keyed on (path, modification time, size)
+_file_hashes = {}
+
+
+def file_hash(path):
+    """
+    Computes the SHA-256 hash of a file, reusing the result while the file is unchanged.
+
+    Args:
+        path (str): Location of the file.
+
+    Returns:
+        str: The hexadecimal digest of the file contents.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, mode="rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def cached_table(sources, version=1):
+    """
+    Stores the output of a cleaner in an on-disk Parquet cache.
+
+    The cache file is fingerprinted by the hash of every source file, the cleaner's
+    version number and the source code of this whole module. Cleaners rely on helpers
+    (e.g., compact_table, country_index) and on other cleaners, so a change to any of
+    them must not be served from a stale cache. Changing any of these writes a new cache
+    file and removes the stale one. If Parquet support (pyarrow) is unavailable the
+    cleaner simply runs every time.
+
+    Args:
+        sources (callable): Returns the list of files the cleaner reads. Evaluated on
+                            every call so that changed paths are picked up.
+        version (int): Version of the cleaner. Bump it when its output changes for a
+                       reason outside this module (e.g., the cache format).
+
+    Returns:
+        callable: A decorator for cleaners that take no arguments.
+    """
+
+    def decorator(cleaner):
+        @functools.wraps(cleaner)
+        def wrapper():
+            fingerprint = hashlib.sha256()
+            fingerprint.update(f"{cleaner.__name__}:{version}".encode())
+            fingerprint.update(inspect.getsource(inspect.getmodule(cleaner)).encode())
+            for source in sources():
+                fingerprint.update(file_hash(source).encode())
+            path = os.path.join(
+                cache_dir, f"{cleaner.__name__}-{fingerprint.hexdigest()[:16]}.parquet"
+            )
+
+            with tracing.stage("clean", table=cleaner.__name__) as record:
+
+                def traced(table, cache):
+                    record.update(cache=cache, rows=len(table))
+                    if tracing.enabled():
+                        # Memory held by the table, including its text columns
+                        record["bytes"] = int(memory_footprint(table)["Total"])
+                    return table
+
+                try:
+                    return traced(pd.read_parquet(path), "hit")
+                except FileNotFoundError:
+                    pass
+                except ImportError:
+                    return traced(cleaner(), "unavailable")
+
+                table = traced(cleaner(), "miss")
+
+                # Remove finished files of older fingerprints; temporary files belong to
+                # other processes writing the cache at the same time
+                os.makedirs(cache_dir, exist_ok=True)
+                for stale in os.listdir(cache_dir):
+                    stale = os.path.join(cache_dir, stale)
+                    if (
+                        os.path.basename(stale).startswith(f"{cleaner.__name__}-")
+                        and stale.endswith(".parquet")
+                        and stale != path
+                    ):
+                        try:
+                            os.remove(stale)
+                        except FileNotFoundError:
+                            pass
+                # Write to a temporary file first so readers never see partial output
+                table.to_parquet(f"{path}.{os.getpid()}.tmp")
+                try:
+                    os.replace(f"{path}.{os.getpid()}.tmp", path)
+                except FileNotFoundError:
+                    pass
+                return table
+
+        wrapper.uncached = cleaner
+        return wrapper
+
+    return decorator
+
+
+def compact_table(table):
+    """
+    Converts the columns of a cleaned table to the smallest dtypes that hold them.
+
+    - Text columns (names, subregions, sex) become categorical.
+    - Integer columns (years, location codes) are downcast, e.g. to int16.
+    - Float columns holding whole numbers (migrant stocks) become the smallest nullable
+      integer dtype, so missing values are kept and sums are not rounded.
+    - Other float columns (rates) stay float64, since float32 values lose precision when
+      VegaFusion serializes them into the chart specification.
+
+    Args:
+        table (pd.DataFrame): A cleaned table. It is modified in place.
+
+    Returns:
+        pd.DataFrame: The same table with compact dtypes.
+    """
+    for column in table.columns:
+        values = table[column]
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            table[column] = values.astype("category")
+        elif pd.api.types.is_integer_dtype(values):
+            table[column] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values):
+            if (values.dropna() % 1 == 0).all():
+                table[column] = pd.to_numeric(
+                    values.astype("Int64"), downcast="integer"
+                )
+    return table
+
+
+def memory_footprint(table):
+    """
+    Reports the memory used by a table, including the contents of text columns.
+
+    Args:
+        table (pd.DataFrame): The table to measure.
+
+    Returns:
+        pd.Series: Bytes used by each column, with the total under 'Total'.
+    """
+    usage = table.memory_usage(deep=True, index=False)
+    return pd.concat([usage, pd.Series({"Total": usage.sum()})])
+
+
+def read_aggregates():
+    """
+    Reads the classification of countries and areas into subregions and regions.
+
+    The annex of the aggregates correspondence table lists, for every country or area,
+    its geographic subregion, SDG region and geographic region, followed by one column
+    per development or income group holding the group's code for its members.
+
+    Returns:
+        pd.DataFrame: One row per country or area with the columns 'Location code',
+                      'Name', 'Subregion code', 'Subregion', 'SDG region code', 'SDG region',
+                      'Geographic region code' and 'Geographic region', followed by one
+                      column per group named by the group's code (e.g., 901).
+    """
+    annex = read_raw_table(aggregates_data, sheet_name="Annex", skiprows=10)
+    annex = annex[annex.iloc[:, 6] == "Country/Area"]
+    aggregates = annex.iloc[:, [3, 1, 9, 10, 13, 14, 15, 16]].copy()
+    aggregates.columns = [
+        "Location code",
+        "Name",
+        "Subregion code",
+        "Subregion",
+        "SDG region code",
+        "SDG region",
+        "Geographic region code",
+        "Geographic region",
+    ]
+    # Northern America is not divided into geographic subregions: its countries only
+    # have the subregion of the SDG regions (918), which stands in for it
+    missing = aggregates["Subregion code"].isna().to_numpy()
+    aggregates.loc[missing, ["Subregion code", "Subregion"]] = annex.iloc[
+        missing, [11, 12]
+    ].to_numpy()
+    groups = annex.iloc[:, 17:]
+    aggregates[[int(str(name).split("\n")[-1]) for name in groups.columns]] = groups
+    aggregates["Name"] = aggregates["Name"].str.strip().str.rstrip("*")
+    for level in ["Subregion", "SDG region", "Geographic region"]:
+        aggregates[level] = aggregates[level].str.strip()
+        # Each country belongs to exactly one aggregate of the partition levels
+        unassigned = aggregates.loc[aggregates[f"{level} code"].isna(), "Name"]
+        if len(unassigned):
+            raise ValueError(
+                f"Countries or areas without a {level} in {aggregates_data}: "
+                + ", ".join(unassigned)
+            )
+    return aggregates.reset_index(drop=True)
+
+
+def read_aggregate_groups():
+    """
+    Reads the aggregates listed in the correspondence table (regions, subregions and groups).
+
+    Returns:
+        pd.DataFrame: One row per aggregate with the columns 'Location code', 'Name' and
+                      'Type' (e.g., 'SDG region' or 'Income group').
+    """
+    annex = read_raw_table(aggregates_data, sheet_name="Annex", skiprows=10)
+    groups = annex[annex.iloc[:, 6].notna() & (annex.iloc[:, 6] != "Country/Area")]
+    groups = groups.iloc[:, [3, 1, 6]].copy()
+    groups.columns = ["Location code", "Name", "Type"]
+    groups["Name"] = groups["Name"].str.strip().str.rstrip("*")
+    return groups.reset_index(drop=True)
+
+
+# Levels of aggregation of the correspondence table. Countries belong to one aggregate
+# of the first three levels, and to any number of development and income groups.
+AGGREGATE_LEVELS = [
+    "Subregion",
+    "SDG region",
+    "Geographic region",
+    "Development group",
+    "Income group",
+]
+
+
+class CountryIndex:
+    """
+    The countries of the reference CSV file as NumPy arrays, indexed by a dense integer id.
+
+    Location codes are mapped to ids with a lookup array, so filtering on codes, joining
+    coordinates and looking up names are array indexing operations. Subregion and region
+    membership from the aggregates correspondence table is read the first time it is used.
+
+    Attributes:
+        codes (np.ndarray): The numeric code of each country.
+        names (np.ndarray): The name of each country.
+        alpha2 (np.ndarray): The ISO alpha-2 code of each country.
+        alpha3 (np.ndarray): The ISO alpha-3 code of each country.
+        latitude (np.ndarray): The average latitude of each country.
+        longitude (np.ndarray): The average longitude of each country.
+    """
+
+    def __init__(self, countries):
+        self.codes = countries["Numeric code"].to_numpy()
+        self.names = countries["Country"].to_numpy(dtype=object)
+        self.alpha2 = countries["Alpha-2 code"].to_numpy(dtype=object)
+        self.alpha3 = countries["Alpha-3 code"].to_numpy(dtype=object)
+        self.latitude = countries["Latitude (average)"].to_numpy()
+        self.longitude = countries["Longitude (average)"].to_numpy()
+
+        self._ids = np.full(self.codes.max() + 1, -1)
+        self._ids[self.codes] = np.arange(len(self.codes))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def ids(self, codes):
+        """
+        Maps location codes to dense ids.
+
+        Args:
+            codes (array-like): Location codes.
+
+        Returns:
+            np.ndarray: The id of each code, or -1 for codes that are not countries.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        ids = np.full(codes.shape, -1)
+        valid = (codes >= 0) & (codes < len(self._ids))
+        ids[valid] = self._ids[codes[valid]]
+        return ids
+
+    def contains(self, codes):
+        """
+        Checks which location codes are countries.
+
+        Args:
+            codes (array-like): Location codes.
+
+        Returns:
+            np.ndarray: Boolean mask, True for codes in the reference CSV file.
+        """
+        return self.ids(codes) >= 0
+
+    def codes_for_names(self, names):
+        """
+        Maps country names to location codes.
+
+        Names are looked up among the names of the CSV file and the UN names of the
+        aggregates correspondence table (e.g., 'Republic of Moldova').
+
+        Args:
+            names (array-like): Country names.
+
+        Returns:
+            np.ndarray: The location code of each name, or -1 for unknown names.
+        """
+        membership = self.membership
+        lookup = pd.concat(
+            [
+                pd.Series(self.codes, index=self.names),
+                pd.Series(
+                    membership["Location code"].to_numpy(),
+                    index=membership["Name"].to_numpy(dtype=object),
+                ),
+            ]
+        )
+        lookup = lookup[lookup.index.notna() & ~lookup.index.duplicated()]
+        return lookup.reindex(names).fillna(-1).to_numpy(dtype=int)
+
+    def take(self, values, codes, fill=np.nan):
+        """
+        Looks up a per-country array (e.g., names or latitude) for location codes.
+
+        Args:
+            values (np.ndarray): An array aligned with the country ids.
+            codes (array-like): Location codes.
+            fill: The value for codes that are not countries. Defaults to NaN.
+
+        Returns:
+            np.ndarray: The value for each code.
+        """
+        ids = self.ids(codes)
+        taken = np.asarray(values, dtype=object if fill is None else None)[ids]
+        if (ids < 0).any():
+            taken = taken.astype(
+                object if fill is None else np.result_type(taken, fill)
+            )
+            taken[ids < 0] = fill
+        return taken
+
+    @functools.cached_property
+    def membership(self):
+        """
+        Subregion and region of each country, aligned with the country ids.
+
+        Returns:
+            pd.DataFrame: The columns of read_aggregates, one row per country id, with
+                          missing values for countries not in the correspondence table.
+        """
+        aggregates = read_aggregates()
+        rows = pd.Series(np.arange(len(aggregates)), index=aggregates["Location code"])
+        positions = rows.reindex(self.codes).to_numpy()
+        membership = aggregates.reindex(positions).reset_index(drop=True)
+        membership["Location code"] = self.codes
+        return membership
+
+    @property
+    def subregion_codes(self):
+        """The geographic subregion code of each country (NaN if unknown)."""
+        return self.membership["Subregion code"].to_numpy(dtype=float)
+
+    def aggregation(self, level):
+        """
+        Builds the sparse matrix that sums country-level values into the aggregates of a level.
+
+        Args:
+            level (str): One of AGGREGATE_LEVELS.
+
+        Returns:
+            tuple: The matrix of shape (aggregates, countries), with a one where a country
+                   belongs to an aggregate, and the code and name of each aggregate, sorted
+                   by code.
+        """
+        from scipy import sparse
+
+        if level not in AGGREGATE_LEVELS:
+            raise ValueError(
+                f"Unknown aggregate level {level!r}, expected one of {AGGREGATE_LEVELS}"
+            )
+        membership = self.membership
+        if level in membership.columns:
+            # Partition levels: one code column and one name column
+            groups = (
+                membership[[f"{level} code", level]]
+                .dropna()
+                .drop_duplicates(f"{level} code")
+                .sort_values(f"{level} code")
+            )
+            codes = groups[f"{level} code"].to_numpy(dtype=int)
+            names = groups[level].to_numpy(dtype=object)
+            country_codes = membership[f"{level} code"].to_numpy(dtype=float)
+            members = np.nonzero(~np.isnan(country_codes))[0]
+            rows = np.searchsorted(codes, country_codes[members])
+        else:
+            # Overlapping groups: one membership column per group
+            groups = read_aggregate_groups()
+            groups = groups[
+                (groups["Type"] == level)
+                & groups["Location code"].isin(membership.columns)
+            ].sort_values("Location code")
+            codes = groups["Location code"].to_numpy(dtype=int)
+            names = groups["Name"].to_numpy(dtype=object)
+            present = membership[list(codes)].notna().to_numpy()
+            members, rows = np.nonzero(present)
+
+        matrix = sparse.csr_matrix(
+            (np.ones(len(members)), (rows, members)), shape=(len(codes), len(self))
+        )
+        return matrix, codes, names
+
+
+# Loaded country indexes, keyed on (path, modification time)
+_country_indexes = {}
+
+
+def country_index():
+    """
+    Returns the index of the countries in the reference CSV file, loaded once per process.
+
+    Returns:
+        CountryIndex: The countries, reloaded only if the CSV file changes.
+    """
+    key = (countries_data, os.path.getmtime(countries_data))
+    if key not in _country_indexes:
+        _country_indexes.clear()
+        _country_indexes[key] = CountryIndex(pd.read_csv(countries_data))
+    return _country_indexes[key]
+
+
+# Loaded area indexes, keyed on (path, modification time)
+_area_indexes = {}
+
+
+def area_index():
+    """
+    Returns the index of the countries or areas of the aggregates correspondence table.
+
+    The correspondence table lists some areas under codes that are missing from the
+    reference CSV file (e.g., Sudan under 729 instead of 736, or the Channel Islands), so
+    regional sums are keyed on its codes instead. The index has no coordinates.
+
+    Returns:
+        CountryIndex: The countries or areas, reloaded only if the workbook changes.
+    """
+    key = (aggregates_data, os.path.getmtime(aggregates_data))
+    if key not in _area_indexes:
+        _area_indexes.clear()
+        aggregates = read_aggregates()
+        _area_indexes[key] = CountryIndex(
+            pd.DataFrame(
+                {
+                    "Country": aggregates["Name"],
+                    "Alpha-2 code": None,
+                    "Alpha-3 code": None,
+                    "Numeric code": aggregates["Location code"].astype(int),
+                    "Latitude (average)": np.nan,
+                    "Longitude (average)": np.nan,
+                }
+            )
+        )
+    return _area_indexes[key]
+
+
+@cached_table(lambda: [stock_data, countries_data])
 def clean_total_stock():
     """
     Cleans and transforms migration stock data from wide to long format.
 
     The function performs the following steps:
-    1. Reads the migration stock data from an Excel file (sheet "Table 1") while skipping initial rows.
-    2. Replaces placeholder values (e.g., "..") with NaN for proper data handling.
+    1. Reads the migration stock data from the shared parse of the Excel file (sheet "Table 1").
+    2. Relies on the shared parse to replace placeholder values (e.g., "..") with NaN.
     3. Renames columns for better readability and consistency.
     4. Filters the data to retain rows where both the destination and origin are countries, using a reference CSV file.
     5. Keeps only the necessary columns for analysis.
     6. Transforms the data from wide format (with years as columns) to long format (with years as rows).
     7. Converts the 'Migration' column to numeric, coercing invalid values to NaN.
+    8. Converts columns to compact dtypes (categorical names, int16 years and codes).
+
+    With streaming set, the same table is built by stream_total_stock instead.
 
     Returns:
         pd.DataFrame: A cleaned and transformed DataFrame containing the migration stock data.
                       The output includes the columns 'Destination', 'Destination code', 'Origin',
                       'Origin code', 'Year', and 'Migration'.
     """
-    # Data frame
-    total_stock = pd.read_excel(stock_data, sheet_name="Table 1", skiprows=10, header=0)
-    total_stock = total_stock.iloc[:, 1:]
+    if streaming:
+        return stream_total_stock()
 
-    # Correctly name missing values
-    total_stock.replace("..", np.nan, inplace=True)
+    # Data frame (missing values are already named correctly)
+    total_stock = read_stock_table().iloc[:, 1:]
 
     # Rename columns
-    total_stock.rename(
+    total_stock = total_stock.rename(
         columns={
             "Region, development group, country or area of destination": "Destination",
             "Location code of destination": "Destination code",
             "Region, development group, country or area of origin": "Origin",
             "Location code of origin": "Origin code",
         },
-        inplace=True,
     )
 
     # Keep only countries for destination and origin (original data frame has aggregations)
-    countries = pd.read_csv(countries_data)
-    # 1. Destination
-    total_stock["M1"] = total_stock["Destination code"].isin(countries["Numeric code"])
-    # 2. Origin
-    total_stock["M2"] = total_stock["Origin code"].isin(countries["Numeric code"]) | (
-        total_stock["Origin code"] == 2003
-    )
-    # 3. Keep only if both are countries
-    total_stock = total_stock[total_stock["M1"] & total_stock["M2"]].copy()
+    countries = country_index()
+    with tracing.stage("isin", table="clean_total_stock") as record:
+        # 1. Destination
+        total_stock["M1"] = countries.contains(total_stock["Destination code"])
+        # 2. Origin
+        total_stock["M2"] = countries.contains(total_stock["Origin code"]) | (
+            total_stock["Origin code"] == OTHER_ORIGIN
+        )
+        # 3. Keep only if both are countries
+        total_stock = total_stock[total_stock["M1"] & total_stock["M2"]].copy()
+        record["rows"] = len(total_stock)
 
     # Keep only neccesary columns
     total_stock = total_stock[
@@ -72,46 +640,96 @@ def clean_total_stock():
     ]
 
     # Transform from wide to long
-    year_columns = [1990, 1995, 2000, 2005, 2010, 2015, 2020]
-    total_stock = pd.melt(
-        total_stock,
-        id_vars=[col for col in total_stock.columns if col not in year_columns],
-        value_vars=year_columns,
-        var_name="Year",
-        value_name="Migration",
-    )
+    year_columns = YEARS
+    with tracing.stage("melt", table="clean_total_stock") as record:
+        total_stock = pd.melt(
+            total_stock,
+            id_vars=[col for col in total_stock.columns if col not in year_columns],
+            value_vars=year_columns,
+            var_name="Year",
+            value_name="Migration",
+        )
+        record["rows"] = len(total_stock)
 
     # Change Value column to numeric
     total_stock["Migration"] = pd.to_numeric(total_stock["Migration"], errors="coerce")
+    total_stock["Year"] = total_stock["Year"].astype(int)
 
-    return total_stock
+    return compact_table(total_stock)
 
 
+@cached_table(lambda: [stock_data, aggregates_data])
+def clean_area_stock():
+    """
+    Cleans the migration stock between the countries or areas of the correspondence table.
+
+    The table is built as clean_total_stock, but keeps the rows whose destination and
+    origin are countries or areas of the aggregates correspondence table (area_index)
+    instead of the reference CSV file, so that regional sums include every member of a
+    region. Migrants from other or unknown origins belong to no region and are left out.
+
+    Returns:
+        pd.DataFrame: The migration stock with the columns of clean_total_stock.
+    """
+    areas = area_index().codes
+    if streaming:
+        return stream_total_stock(destinations=areas, origins=areas)
+
+    # Data frame (missing values are already named correctly)
+    area_stock = read_stock_table().rename(
+        columns={
+            "Region, development group, country or area of destination": "Destination",
+            "Location code of destination": "Destination code",
+            "Region, development group, country or area of origin": "Origin",
+            "Location code of origin": "Origin code",
+        },
+    )
+    id_columns = ["Destination", "Destination code", "Origin", "Origin code"]
+    with tracing.stage("isin", table="clean_area_stock") as record:
+        keep = np.isin(area_stock["Destination code"], areas) & np.isin(
+            area_stock["Origin code"], areas
+        )
+        area_stock = area_stock.loc[keep, id_columns + YEARS]
+        record["rows"] = len(area_stock)
+
+    # Transform from wide to long
+    with tracing.stage("melt", table="clean_area_stock") as record:
+        area_stock = pd.melt(
+            area_stock,
+            id_vars=id_columns,
+            value_vars=YEARS,
+            var_name="Year",
+            value_name="Migration",
+        )
+        record["rows"] = len(area_stock)
+    area_stock["Migration"] = pd.to_numeric(area_stock["Migration"], errors="coerce")
+    area_stock["Year"] = area_stock["Year"].astype(int)
+    return compact_table(area_stock)
+
+
+@cached_table(lambda: [estimates_data], version=2)
 def clean_estimates():
     """
-    Cleans and filters migration rate estimates for specific subregions.
+    Cleans and filters migration rate estimates for the SDG regions.
 
     The function performs the following steps:
-    1. Reads migration estimates data from an Excel file (sheet "Estimates") while skipping initial rows.
-    2. Replaces placeholder values (e.g., "..") with NaN for proper data handling.
-    3. Filters the data to retain only rows corresponding to specified subregion codes.
+    1. Reads migration estimates data from the shared parse of the Excel file (sheet "Estimates").
+    2. Relies on the shared parse to replace placeholder values (e.g., "..") with NaN.
+    3. Filters the data to retain only the rows of SDG regions.
     4. Keeps only necessary columns for analysis and renames them for clarity.
+    5. Converts columns to compact dtypes (categorical subregions, int16 years).
 
     Returns:
         pd.DataFrame: A cleaned DataFrame containing net migration rate estimates by subregion and year.
                       The output includes the columns 'Subregion', 'Year', and 'Net Migration Rate'.
     """
-    # Data frame
-    estimates = pd.read_excel(
-        estimates_data, sheet_name="Estimates", skiprows=16, header=0
-    )
-
-    # Correctly name missing values
-    estimates.replace("..", np.nan, inplace=True)
+    # Data frame (missing values are already named correctly)
+    estimates = read_raw_table(estimates_data, sheet_name="Estimates", skiprows=16)
 
-    # Keep only subregions
-    subregion_codes = [1834, 1833, 1831, 1832, 1830, 1835, 1836, 1829]
-    estimates = estimates[estimates["Location code"].isin(subregion_codes)]
+    # Keep only SDG regions
+    with tracing.stage("isin", table="clean_estimates") as record:
+        estimates = estimates[estimates["Type"] == "SDG region"]
+        record["rows"] = len(estimates)
 
     # Keep only neccesary columns and rename them
     estimates = estimates[
@@ -129,160 +747,744 @@ def clean_estimates():
         },
         inplace=True,
     )
-    return estimates
+    estimates["Year"] = estimates["Year"].astype(int)
+    return compact_table(estimates)
 
 
+@cached_table(lambda: [stock_data, aggregates_data])
 def clean_region_stock():
     """
-    Cleans and transforms regional migration stock data from wide to long format.
+    Computes the migration stock between SDG regions from the country-level data.
 
     The function performs the following steps:
-    1. Reads migration stock data from an Excel file (sheet "Table 1") while skipping initial rows.
-    2. Replaces placeholder values (e.g., "..") with NaN for proper data handling.
-    3. Renames columns for consistency and readability.
-    4. Filters the data to include only rows where both destination and origin are specified subregions.
-    5. Keeps only the necessary columns for analysis.
-    6. Transforms the data from wide format (with years as columns) to long format (with years as rows).
-    7. Performs additional transformations to standardize subregion names and ensures numeric consistency for migration values.
+    1. Reads the cleaned migration stock between countries or areas (clean_area_stock).
+    2. Sums it into the SDG regions of the aggregates correspondence table, for destination
+       and origin, with one sparse matrix product per year (aggregate_stock).
+    3. Renames columns for consistency with the estimates and the charts.
+    4. Standardizes subregion names to match the estimates.
+    5. Converts columns to compact dtypes (categorical subregions, int16 years).
 
     Returns:
         pd.DataFrame: A cleaned and transformed DataFrame containing the regional migration stock data.
                       The output includes the columns 'Subregion', 'source', 'Year', and 'value'.
     """
-    # Data frame
-    total_stock = pd.read_excel(stock_data, sheet_name="Table 1", skiprows=10, header=0)
-    # Correctly name missing values
-    total_stock.replace("..", np.nan, inplace=True)
-    # Rename columns
-    total_stock.rename(
-        columns={
-            "Region, development group, country or area of destination": "Subregion",
-            "Location code of destination": "Destination code",
-            "Region, development group, country or area of origin": "source",
-            "Location code of origin": "Origin code",
-        },
-        inplace=True,
+    return subregion_stock("SDG region")
+
+
+def aggregate_stock(level, origin_level=None, area_stock=None):
+    """
+    Sums the country-level migration stock into the aggregates of a level.
+
+    For each year, the stock between countries is a sparse matrix X (destinations by
+    origins), and the stock between aggregates is M_d @ X @ M_o.T, where M_d and M_o are the
+    aggregation matrices of the destination and origin levels (CountryIndex.aggregation).
+    Countries are those of the correspondence table (area_index), so every member of an
+    aggregate is counted.
+
+    Args:
+        level (str): The aggregate level of destinations, one of AGGREGATE_LEVELS.
+        origin_level (str, optional): The aggregate level of origins. Defaults to level.
+        area_stock (pd.DataFrame, optional): Cleaned migration stock between countries or
+                                             areas, if already loaded. Defaults to
+                                             clean_area_stock().
+
+    Returns:
+        pd.DataFrame: Migration stock with the columns 'Destination', 'Destination code',
+                      'Origin', 'Origin code', 'Year' and 'Migration', sorted by year,
+                      destination code and origin code.
+    """
+    from scipy import sparse
+
+    if area_stock is None:
+        area_stock = clean_area_stock()
+    countries = area_index()
+    destination_matrix, destination_codes, destination_names = countries.aggregation(
+        level
     )
-    # Keep only subregions
-    subregion_codes = [947, 921, 927, 1834, 1833, 1831, 1832, 1830, 1835, 1836, 1829]
-    region_stock = total_stock[
-        total_stock["Destination code"].isin(subregion_codes)
-        & total_stock["Origin code"].isin(subregion_codes)
-    ]
-    region_stock = region_stock[
-        ["Subregion", "source", 1990, 1995, 2000, 2005, 2010, 2015, 2020]
-    ]
-    # Transform from wide to long
-    year_columns = [1990, 1995, 2000, 2005, 2010, 2015, 2020]
-    region_stock = pd.melt(
-        region_stock,
-        id_vars=[col for col in region_stock.columns if col not in year_columns],
-        value_vars=year_columns,
-        var_name="Year",
-        value_name="value",
+    origin_matrix, origin_codes, origin_names = countries.aggregation(
+        origin_level or level
+    )
+
+    destinations = countries.ids(area_stock["Destination code"])
+    origins = countries.ids(area_stock["Origin code"])
+    known = (destinations >= 0) & (origins >= 0)
+    values = area_stock["Migration"].to_numpy(dtype=float, na_value=0.0)
+    years = area_stock["Year"].to_numpy()
+
+    # Pairs of aggregates, destination-major
+    destination_ids = np.repeat(np.arange(len(destination_codes)), len(origin_codes))
+    origin_ids = np.tile(np.arange(len(origin_codes)), len(destination_codes))
+
+    tables = []
+    for year in np.unique(years):
+        rows = known & (years == year)
+        stock = sparse.csr_matrix(
+            (values[rows], (destinations[rows], origins[rows])),
+            shape=(len(countries), len(countries)),
+        )
+        with tracing.stage("aggregate", level=level, year=year):
+            aggregated = destination_matrix @ stock @ origin_matrix.T
+        tables.append(
+            pd.DataFrame(
+                {
+                    "Destination": destination_names[destination_ids],
+                    "Destination code": destination_codes[destination_ids],
+                    "Origin": origin_names[origin_ids],
+                    "Origin code": origin_codes[origin_ids],
+                    "Year": year,
+                    "Migration": aggregated.toarray().ravel(),
+                }
+            )
+        )
+    return compact_table(pd.concat(tables, ignore_index=True))
+
+
+def subregion_stock(grouping="SDG region", area_stock=None):
+    """
+    Computes the migration stock into each SDG region from the aggregates of any level.
+
+    The destinations are the SDG regions of the estimates, so the table can be shown next
+    to the net migration rates, and the origins are grouped as requested.
+
+    Args:
+        grouping (str): The aggregate level of origins, one of AGGREGATE_LEVELS.
+                        Defaults to 'SDG region'.
+        area_stock (pd.DataFrame, optional): Cleaned migration stock between countries or
+                                             areas, if already loaded. Defaults to
+                                             clean_area_stock().
+
+    Returns:
+        pd.DataFrame: Migration stock with the columns 'Subregion', 'source', 'Year' and
+                      'value'.
+    """
+    region_stock = aggregate_stock(
+        "SDG region", origin_level=grouping, area_stock=area_stock
     )
+    region_stock = region_stock.rename(
+        columns={"Destination": "Subregion", "Origin": "source", "Migration": "value"}
+    )[["Subregion", "source", "Year", "value"]]
     # Transformations to unify with estimates
-    region_stock["Subregion"] = region_stock["Subregion"].str.strip()
-    region_stock["Subregion"] = region_stock["Subregion"].replace(
-        {"Australia and New Zealand": "Australia/New Zealand"}
+    region_stock["Subregion"] = (
+        region_stock["Subregion"]
+        .astype(str)
+        .replace({"Australia and New Zealand": "Australia/New Zealand"})
     )
-    region_stock["value"] = pd.to_numeric(region_stock["value"], errors="coerce")
-
-    return region_stock
+    return compact_table(region_stock)
 
 
+@cached_table(lambda: [stock_data, countries_data])
 def clean_sex_stock():
     """
     Cleans and transforms migration stock data by sex from wide to long format.
 
     The function performs the following steps:
-    1. Reads migration stock data from an Excel file (sheet "Table 1") while skipping initial rows.
-    2. Replaces placeholder values (e.g., "..") with NaN for proper data handling.
+    1. Reads migration stock data from the shared parse of the Excel file (sheet "Table 1").
+    2. Relies on the shared parse to replace placeholder values (e.g., "..") with NaN.
     3. Renames columns for consistency and readability.
     4. Filters the data to include only rows where both destination and origin are countries.
-    5. Transforms the data into a long format, separating the migration data by year and sex.
-    6. Extracts and standardizes the year and sex information from column names.
+    5. Converts the sex columns to numeric and reshapes them into a long format with one
+       NumPy reshape, building the integer 'Year' and categorical 'Sex' columns directly
+       instead of parsing them from the column names.
+    6. Converts all columns to compact dtypes (categorical names and sex, int16 years
+       and codes).
+
+    With streaming set, the same table is built by stream_sex_stock instead.
 
     Returns:
         pd.DataFrame: A cleaned and transformed DataFrame containing the migration stock data by sex.
                       The output includes the columns 'Destination', 'Destination code', 'Origin',
                       'Origin code', 'Year', 'Sex', and 'Migration'.
     """
-    # Data frame
-    total_stock = pd.read_excel(stock_data, sheet_name="Table 1", skiprows=10, header=0)
-    # Correctly name missing values
-    total_stock.replace("..", np.nan, inplace=True)
+    if streaming:
+        return stream_sex_stock()
+
+    # Data frame (missing values are already named correctly)
+    total_stock = read_stock_table()
     # Rename columns
-    total_stock.rename(
+    total_stock = total_stock.rename(
         columns={
             "Region, development group, country or area of destination": "Destination",
             "Location code of destination": "Destination code",
             "Region, development group, country or area of origin": "Origin",
             "Location code of origin": "Origin code",
         },
-        inplace=True,
     )
     # Keep only countries for destination and origin (original data frame has aggregations)
-    countries = pd.read_csv(countries_data)
-    # 1. Destination
-    total_stock["M1"] = total_stock["Destination code"].isin(countries["Numeric code"])
-    # 2. Origin
-    total_stock["M2"] = total_stock["Origin code"].isin(countries["Numeric code"]) | (
-        total_stock["Origin code"] == 2003
+    countries = country_index()
+    with tracing.stage("isin", table="clean_sex_stock") as record:
+        # 1. Destination
+        total_stock["M1"] = countries.contains(total_stock["Destination code"])
+        # 2. Origin
+        total_stock["M2"] = countries.contains(total_stock["Origin code"]) | (
+            total_stock["Origin code"] == OTHER_ORIGIN
+        )
+        # 3. Keep only if both are countries
+        total_stock = total_stock[total_stock["M1"] & total_stock["M2"]].copy()
+        record["rows"] = len(total_stock)
+    # Transform from wide to long: the columns of each sex ("1990.1", ..., "2020.2") are
+    # reshaped as one block, so years and sexes are repeated instead of parsed from names
+    id_columns = ["Destination", "Destination code", "Origin", "Origin code"]
+    year_columns = YEARS
+    sexes = SEXES
+    value_columns = [
+        column for block in sex_columns(year_columns).values() for column in block
+    ]
+    with tracing.stage("melt", table="clean_sex_stock") as record:
+        values = (
+            total_stock[value_columns]
+            .apply(pd.to_numeric, errors="coerce")
+            .to_numpy(dtype=float)
+        )
+        n_rows, n_columns = values.shape
+        sex_stock_long = total_stock[id_columns].iloc[
+            np.tile(np.arange(n_rows), n_columns)
+        ]
+        sex_stock_long = sex_stock_long.reset_index(drop=True)
+        sex_stock_long["Year"] = np.repeat(
+            np.tile(year_columns, len(sexes)), n_rows
+        ).astype(np.int16)
+        sex_stock_long["Sex"] = pd.Categorical.from_codes(
+            np.repeat(np.arange(len(sexes), dtype=np.int8), len(year_columns) * n_rows),
+            categories=sexes,
+        )
+        # Column-major order, to match the repeated years and sexes
+        sex_stock_long["Migration"] = values.ravel(order="F")
+        record["rows"] = len(sex_stock_long)
+
+    return compact_table(sex_stock_long)
+
+
+@cached_table(lambda: [flows_data, countries_data, aggregates_data])
+def clean_flow_totals():
+    """
+    Cleans and transforms the international migration flow totals from wide to long format.
+
+    The function performs the following steps:
+    1. Reads the flow totals from the shared parse of the Excel file (sheet "Totals").
+    2. Relies on the shared parse to replace placeholder values (e.g., "..") with NaN.
+    3. Matches reporting countries to location codes by name, since the workbook has no
+       codes, updating names that changed since the 2015 revision.
+    4. Transforms the data from wide format (with years as columns) to long format (with
+       years as rows), keeping only the years with a reported flow.
+    5. Converts columns to compact dtypes (categorical names, int16 years).
+
+    Returns:
+        pd.DataFrame: A cleaned DataFrame containing yearly migration flows by reporting country.
+                      The output includes the columns 'Country', 'Country code', 'Criteria'
+                      (e.g., 'Residence'), 'Type' ('Immigrants' or 'Emigrants'), 'Coverage'
+                      ('Both', 'Citizens' or 'Foreigners'), 'Year' and 'Flow'.
+    """
+    # Data frame (missing values are already named correctly)
+    flows = read_raw_table(flows_data, sheet_name="Totals", skiprows=16)
+    flows = flows.rename(columns={"CntName": "Country"})
+
+    # Location codes, from the names used by the UN today
+    names = (
+        flows["Country"]
+        .str.strip()
+        .replace(
+            {
+                "The former Yugoslav Republic of Macedonia": "North Macedonia",
+                "United Kingdom of Great Britain and Northern Ireland": "United Kingdom",
+            }
+        )
     )
-    # 3. Keep only if both are countries
-    total_stock = total_stock[total_stock["M1"] & total_stock["M2"]].copy()
+    flows["Country code"] = country_index().codes_for_names(names)
+    flows = flows[flows["Country code"] >= 0]
+
     # Transform from wide to long
-    sex_stock = total_stock[
+    year_columns = [col for col in flows.columns if isinstance(col, int)]
+    with tracing.stage("melt", table="clean_flow_totals") as record:
+        flows = pd.melt(
+            flows,
+            id_vars=["Country", "Country code", "Criteria", "Type", "Coverage"],
+            value_vars=year_columns,
+            var_name="Year",
+            value_name="Flow",
+        )
+        record["rows"] = len(flows)
+    flows["Flow"] = pd.to_numeric(flows["Flow"], errors="coerce")
+    flows = flows.dropna(subset=["Flow"]).reset_index(drop=True)
+    flows["Year"] = flows["Year"].astype(int)
+
+    return compact_table(flows)
+
+
+# Criteria of the flow totals, from the most to the least preferred
+FLOW_CRITERIA = ["Residence", "Citizenship", "Place of birth"]
+
+
+def flow_stock_comparison(
+    flow_totals=None, total_stock=None, years=5, return_excluded=False
+):
+    """
+    Compares the migration flows of each country with the change of its migrant stock.
+
+    Countries report flows under different criteria (the place of residence, the
+    citizenship or the place of birth of migrants), and some under more than one. To keep
+    one definition per country, only the first criterion a country reports in
+    FLOW_CRITERIA is used, so residence is preferred over citizenship and citizenship over
+    the place of birth. Yearly flows are then totaled per country, preferring figures that
+    cover both citizens and foreigners over the sum of the two, and summed over the periods
+    between the years of the stock data (1990-1995, 1995-2000, ...). Only periods with a
+    flow for every year are kept. Flows and stocks are joined by location code.
+
+    Countries left out of the comparison are counted in the trace, and listed with the
+    reason with return_excluded.
+
+    Args:
+        flow_totals (pd.DataFrame, optional): Cleaned flow totals, if already loaded.
+                                              Defaults to clean_flow_totals().
+        total_stock (pd.DataFrame, optional): Cleaned migration stock data, if already
+                                              loaded. Defaults to clean_total_stock().
+        years (int): The length of the periods, in years. Defaults to 5.
+        return_excluded (bool): Whether to also return the countries that were left out.
+                                Defaults to False.
+
+    Returns:
+        pd.DataFrame: One row per country and period with the columns 'Country',
+                      'Country code', 'Year' (start of the period), 'Period', 'Immigrants',
+                      'Emigrants', 'Net flow', 'Stock' (immigrant stock at the start) and
+                      'Stock change'.
+        pd.DataFrame: With return_excluded, the countries that report flows but are not
+                      compared, with the columns 'Country', 'Country code' and 'Reason':
+                      'unknown criteria' (none of FLOW_CRITERIA), 'incomplete periods'
+                      (no period with a flow for every year) or 'no stock' (no migrant
+                      stock for the country code).
+    """
+    if flow_totals is None:
+        flow_totals = clean_flow_totals()
+    if total_stock is None:
+        total_stock = clean_total_stock()
+
+    # One criterion per country, in the order of preference of FLOW_CRITERIA
+    preference = (
+        flow_totals["Criteria"]
+        .astype(str)
+        .map({criteria: rank for rank, criteria in enumerate(FLOW_CRITERIA)})
+    )
+    preferred = preference.groupby(flow_totals["Country code"]).transform("min")
+    reporting = flow_totals.drop_duplicates("Country code")[["Country", "Country code"]]
+    flow_totals = flow_totals[preference == preferred]
+
+    # Total flow by country, type and year (one row per coverage after the selection)
+    coverage = flow_totals.pivot_table(
+        index=["Country code", "Type", "Year"],
+        columns="Coverage",
+        values="Flow",
+        aggfunc="sum",
+        observed=True,
+    ).reindex(columns=["Both", "Citizens", "Foreigners"])
+    totals = coverage["Both"].fillna(coverage["Citizens"] + coverage["Foreigners"])
+    annual = totals.unstack("Type").reindex(columns=["Immigrants", "Emigrants"])
+    annual = annual.reset_index()
+
+    # Sum over the periods of the stock data
+    first_year = int(total_stock["Year"].min())
+    annual = annual[annual["Year"] >= first_year]
+    annual["Period start"] = annual["Year"] - (annual["Year"] - first_year) % years
+    periods = annual.groupby(["Country code", "Period start"]).agg(
+        Immigrants=("Immigrants", lambda flow: flow.sum(min_count=years)),
+        Emigrants=("Emigrants", lambda flow: flow.sum(min_count=years)),
+        Years=("Year", "nunique"),
+    )
+    periods = periods[periods["Years"] == years].drop(columns="Years").reset_index()
+    periods["Net flow"] = periods["Immigrants"] - periods["Emigrants"]
+
+    # Immigrant stock at the start and end of each period
+    stock = (
+        total_stock.groupby(["Destination code", "Year"], observed=True)["Migration"]
+        .sum()
+        .astype(float)
+        .unstack("Year")
+    )
+    starts = [year for year in stock.columns if year + years in stock.columns]
+    change = pd.DataFrame(
+        {
+            "Stock": stock[starts].stack(),
+            "Stock change": (
+                stock[[year + years for year in starts]].set_axis(starts, axis=1)
+                - stock[starts]
+            ).stack(),
+        }
+    )
+    change.index.names = ["Country code", "Period start"]
+
+    with tracing.stage("join", table="flow_stock_comparison") as record:
+        comparison = periods.merge(
+            change.reset_index(), on=["Country code", "Period start"]
+        ).rename(columns={"Period start": "Year"})
+
+        # Countries that report flows but are not compared, by the step that drops them
+        codes = reporting["Country code"]
+        reasons = np.select(
+            [
+                ~codes.isin(flow_totals["Country code"]),
+                ~codes.isin(periods["Country code"]),
+                ~codes.isin(comparison["Country code"]),
+            ],
+            ["unknown criteria", "incomplete periods", "no stock"],
+            default="",
+        )
+        excluded = reporting.assign(Reason=reasons)[reasons != ""]
+        record.update(rows=len(comparison), excluded=len(excluded))
+
+    countries = country_index()
+    comparison.insert(
+        0, "Country", countries.take(countries.names, comparison["Country code"])
+    )
+    comparison.insert(
+        3,
+        "Period",
+        comparison["Year"].astype(str) + "-" + (comparison["Year"] + years).astype(str),
+    )
+    if return_excluded:
+        return comparison, excluded.reset_index(drop=True)
+    return comparison
+
+
+@cached_table(lambda: [stock_data, countries_data])
+def clean_growth_metrics():
+    """
+    Computes the change of migration stock between years, for pairs, destinations and origins.
+
+    The function performs the following steps:
+    1. Reads the cleaned migration stock (clean_total_stock) and pivots it to one row per
+       destination/origin pair and one column per year.
+    2. Sums the pairs into one row per destination and one row per origin, and stacks the
+       three levels into a single matrix, next to the total each row is a share of: its
+       destination for pairs, and the world for destinations and origins.
+    3. Computes every metric for all rows and years at once on that matrix:
+       - 'Change' and 'Growth rate': the difference and the compound annual growth rate
+         (CAGR) since the previous year of data.
+       - 'Change since 1990' and 'Growth rate since 1990': the same since the first year.
+       - 'Share': the share of the total.
+    4. Transforms the matrix back to long format and converts columns to compact dtypes.
+
+    Growth rates are missing when the starting stock is zero or missing. Migrants from other
+    or unknown origins (code 2003) count towards destination totals and form their own
+    origin row.
+
+    Returns:
+        pd.DataFrame: The metrics with the columns 'Level' ('Pair', 'Destination' or
+                      'Origin'), 'Destination', 'Destination code', 'Origin', 'Origin code',
+                      'Year', 'Migration' and the metrics above. Origin columns are missing
+                      for destination rows and destination columns for origin rows.
+    """
+    total_stock = clean_total_stock()
+    keys = ["Destination code", "Origin code"]
+    pairs = total_stock.set_index(keys + ["Year"])["Migration"].astype(float)
+    pairs = pairs.unstack("Year").sort_index()
+    years = pairs.columns.to_numpy(dtype=int)
+
+    # Stack pairs, destinations and origins into one matrix of stock by year
+    destinations = pairs.groupby(level="Destination code").sum()
+    origins = pairs.groupby(level="Origin code").sum()
+    stock = np.vstack([pairs.to_numpy(), destinations.to_numpy(), origins.to_numpy()])
+    world = destinations.to_numpy().sum(axis=0, keepdims=True)
+    totals = np.vstack(
         [
-            "Destination",
-            "Destination code",
-            "Origin",
-            "Origin code",
-            "1990.1",
-            "1995.1",
-            "2000.1",
-            "2005.1",
-            "2010.1",
-            "2015.1",
-            "2020.1",
-            "1990.2",
-            "1995.2",
-            "2000.2",
-            "2005.2",
-            "2010.2",
-            "2015.2",
-            "2020.2",
+            destinations.loc[
+                pairs.index.get_level_values("Destination code")
+            ].to_numpy(),
+            np.repeat(world, len(destinations) + len(origins), axis=0),
+        ]
+    )
+
+    # Metrics for every row and year in one pass
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = np.full_like(stock, np.nan)
+        change[:, 1:] = np.diff(stock, axis=1)
+        growth = np.full_like(stock, np.nan)
+        growth[:, 1:] = (stock[:, 1:] / stock[:, :-1]) ** (1 / np.diff(years)) - 1
+        change_since_start = stock - stock[:, :1]
+        growth_since_start = np.full_like(stock, np.nan)
+        growth_since_start[:, 1:] = (stock[:, 1:] / stock[:, :1]) ** (
+            1 / (years[1:] - years[0])
+        ) - 1
+        share = stock / totals
+    growth[~np.isfinite(growth)] = np.nan
+    growth_since_start[~np.isfinite(growth_since_start)] = np.nan
+    share[~np.isfinite(share)] = np.nan
+
+    # Back to long format, one row per level, code and year
+    levels = np.repeat(
+        ["Pair", "Destination", "Origin"],
+        [len(pairs), len(destinations), len(origins)],
+    )
+    missing = np.full(len(destinations) + len(origins), -1)
+    destination_codes = np.concatenate(
+        [
+            pairs.index.get_level_values("Destination code"),
+            destinations.index,
+            missing[len(destinations) :],
         ]
+    )
+    origin_codes = np.concatenate(
+        [
+            pairs.index.get_level_values("Origin code"),
+            missing[: len(destinations)],
+            origins.index,
+        ]
+    )
+    rows = np.repeat(np.arange(len(stock)), len(years))
+    metrics = pd.DataFrame(
+        {
+            "Level": levels[rows],
+            "Destination code": destination_codes[rows],
+            "Origin code": origin_codes[rows],
+            "Year": np.tile(years, len(stock)),
+            "Migration": stock.ravel(),
+            "Change": change.ravel(),
+            "Growth rate": growth.ravel(),
+            "Change since 1990": change_since_start.ravel(),
+            "Growth rate since 1990": growth_since_start.ravel(),
+            "Share": share.ravel(),
+        }
+    )
+
+    # Names as in the stock data, missing for the level's other side
+    destination_names = total_stock.drop_duplicates("Destination code").set_index(
+        "Destination code"
+    )["Destination"]
+    origin_names = total_stock.drop_duplicates("Origin code").set_index("Origin code")[
+        "Origin"
     ]
+    metrics.insert(
+        1,
+        "Destination",
+        metrics["Destination code"].map(destination_names).astype(object),
+    )
+    metrics.insert(3, "Origin", metrics["Origin code"].map(origin_names).astype(object))
+    for column in ["Destination code", "Origin code"]:
+        metrics[column] = metrics[column].astype("Int64").mask(metrics[column] < 0)
+    return compact_table(metrics)
+
+
+def iter_stock_rows(path=None, destinations=None, origins=None, chunksize=5000):
+    """
+    Streams the rows of the migration stock sheet ("Table 1") in chunks.
+
+    The workbook is read row by row in openpyxl's read-only mode, and rows are kept only
+    if their destination and origin codes are selected. Chunks have the columns of
+    read_stock_table, with placeholder values ("..") replaced with NaN, so they can be
+    cleaned or checked like slices of the parsed sheet. Peak memory therefore depends on
+    the chunk size, not on the size of the sheet.
+
+    Args:
+        path (str, optional): Location of the Excel file. Defaults to the stock data.
+        destinations (iterable, optional): Destination codes to keep, e.g. subregions
+                                           of the aggregates table. Defaults to the
+                                           countries in the reference CSV file.
+        origins (iterable, optional): Origin codes to keep. Defaults to the countries in
+                                      the reference CSV file and code 2003 ("Other").
+        chunksize (int): The number of sheet rows per chunk. Defaults to 5000.
+
+    Yields:
+        pd.DataFrame: Chunks of at most chunksize rows of the raw sheet.
+    """
+    import openpyxl
 
-    sex_stock_long = pd.melt(
-        sex_stock,
-        id_vars=["Destination", "Destination code", "Origin", "Origin code"],
-        var_name="Year_Sex",
-        value_name="Migration",
+    if destinations is None or origins is None:
+        country_codes = set(country_index().codes.tolist())
+    destinations = country_codes if destinations is None else set(destinations)
+    origins = country_codes | {OTHER_ORIGIN} if origins is None else set(origins)
+
+    workbook = openpyxl.load_workbook(
+        path or stock_data, read_only=True, data_only=True
+    )
+    try:
+        rows = workbook["Table 1"].iter_rows(min_row=11, values_only=True)
+        header = list(next(rows))
+        destination_code = header.index("Location code of destination")
+        origin_code = header.index("Location code of origin")
+
+        # Year columns come in blocks of both sexes, male and female, named as in the
+        # parsed sheet (e.g., 1990, "1990.1" and "1990.2")
+        year_columns = [
+            i for i, name in enumerate(header) if isinstance(name, (int, float))
+        ]
+        years = [int(header[i]) for i in year_columns[: len(year_columns) // 3]]
+        names = years + [
+            column for block in sex_columns(years).values() for column in block
+        ]
+        for i, name in zip(year_columns, names):
+            header[i] = name
+
+        def frame(chunk):
+            values = np.array(chunk, dtype=object)
+            values[values == ".."] = np.nan
+            table = pd.DataFrame(values, columns=header)
+            for i in [destination_code, origin_code]:
+                table[header[i]] = table[header[i]].astype(int)
+            return table
+
+        chunk = []
+        for row in rows:
+            if row[destination_code] in destinations and row[origin_code] in origins:
+                chunk.append(row)
+                if len(chunk) == chunksize:
+                    yield frame(chunk)
+                    chunk = []
+        if chunk:
+            yield frame(chunk)
+    finally:
+        workbook.close()
+
+
+def iter_stock_chunks(
+    path=None, by_sex=False, destinations=None, origins=None, chunksize=5000
+):
+    """
+    Streams a migration stock sheet ("Table 1") as long-format chunks.
+
+    The rows read by iter_stock_rows are unpivoted as soon as a chunk is full, so only
+    the kept rows of one chunk are held at a time.
+
+    Args:
+        path (str, optional): Location of the Excel file. Defaults to the stock data.
+        by_sex (bool): Whether to read the male and female columns, adding a 'Sex'
+                       column, instead of the columns for both sexes. Defaults to False.
+        destinations (iterable, optional): Destination codes to keep, as in
+                                           iter_stock_rows.
+        origins (iterable, optional): Origin codes to keep, as in iter_stock_rows.
+        chunksize (int): The number of sheet rows per chunk. Defaults to 5000.
+
+    Yields:
+        pd.DataFrame: Chunks with the columns 'Destination', 'Destination code', 'Origin',
+                      'Origin code', 'Year', 'Sex' (when by_sex is True) and 'Migration',
+                      as in clean_total_stock and clean_sex_stock.
+    """
+    ids = {
+        "Destination": "Region, development group, country or area of destination",
+        "Destination code": "Location code of destination",
+        "Origin": "Region, development group, country or area of origin",
+        "Origin code": "Location code of origin",
+    }
+    for chunk in iter_stock_rows(path, destinations, origins, chunksize):
+        years = [name for name in chunk.columns if isinstance(name, int)]
+        if by_sex:
+            sexes = SEXES
+            columns = [
+                column for block in sex_columns(years).values() for column in block
+            ]
+        else:
+            sexes = [None]
+            columns = years
+
+        long = pd.DataFrame(
+            {
+                name: np.tile(chunk[column].to_numpy(), len(columns))
+                for name, column in ids.items()
+            }
+        )
+        for name in ["Destination code", "Origin code"]:
+            long[name] = long[name].astype(np.int16)
+        long["Year"] = np.repeat(
+            np.tile(np.array(years, dtype=np.int16), len(sexes)), len(chunk)
+        )
+        if by_sex:
+            long["Sex"] = pd.Categorical.from_codes(
+                np.repeat(
+                    np.arange(len(sexes), dtype=np.int8), len(years) * len(chunk)
+                ),
+                categories=sexes,
+            )
+        long["Migration"] = pd.to_numeric(
+            chunk[columns].to_numpy(dtype=object).T.ravel(), errors="coerce"
+        )
+        yield long
+
+
+def stream_total_stock(chunksize=5000, destinations=None, origins=None):
+    """
+    Builds the output of clean_total_stock by streaming the workbook.
+
+    Only the kept rows are held in memory, instead of the whole raw sheet and its
+    intermediate copies.
+
+    Args:
+        chunksize (int): The number of sheet rows per chunk. Defaults to 5000.
+        destinations (iterable, optional): Destination codes to keep, as in
+                                           iter_stock_chunks (e.g., for clean_area_stock).
+        origins (iterable, optional): Origin codes to keep, as in iter_stock_chunks.
+
+    Returns:
+        pd.DataFrame: The migration stock data, as clean_total_stock returns it.
+    """
+    total_stock = pd.concat(
+        iter_stock_chunks(
+            destinations=destinations, origins=origins, chunksize=chunksize
+        ),
+        ignore_index=True,
     )
-    # Transformations to identify sex and year based on the previous column
-    sex_stock_long["Year"] = sex_stock_long["Year_Sex"].str[:-2].astype(int)
-    sex_stock_long["Sex"] = sex_stock_long["Year_Sex"].str[-1]
-    sex_stock_long["Sex"] = sex_stock_long["Sex"].replace({"1": "Male", "2": "Female"})
-    sex_stock_long = sex_stock_long.drop("Year_Sex", axis=1)
+    # Rows of the melt in clean_total_stock: by year, then in the order of the sheet
+    total_stock = total_stock.sort_values("Year", kind="stable", ignore_index=True)
+    return compact_table(total_stock)
+
 
-    return sex_stock_long
+def stream_sex_stock(chunksize=5000):
+    """
+    Builds the output of clean_sex_stock by streaming the workbook.
+
+    Args:
+        chunksize (int): The number of sheet rows per chunk. Defaults to 5000.
+
+    Returns:
+        pd.DataFrame: The migration stock data by sex, as clean_sex_stock returns it.
+    """
+    sex_stock = pd.concat(
+        iter_stock_chunks(by_sex=True, chunksize=chunksize), ignore_index=True
+    )
+    # Rows of the reshape in clean_sex_stock: by sex and year, then as in the sheet
+    sex_stock = sex_stock.sort_values(["Sex", "Year"], kind="stable", ignore_index=True)
+    return compact_table(sex_stock)
+
+
+def top_n(table, by, column, n=5):
+    """
+    Selects the n rows with the largest values of a column within each group.
+
+    The table is sorted once by the column and the first n rows of every group are kept,
+    which avoids calling nlargest on each group separately. Ties keep their original order,
+    as with nlargest.
+
+    Args:
+        table (pd.DataFrame): The data to select from.
+        by (str or list): Column(s) that define the groups (e.g., 'Destination code' for the
+                          top origins of each destination, 'Origin code' for the top
+                          destinations of each origin).
+        column (str): The column to rank rows by.
+        n (int): The number of rows to keep per group. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: The selected rows, ordered by group and then by descending value.
+    """
+    with tracing.stage("top_n", column=column, n=n) as record:
+        top = (
+            table.dropna(subset=[column])
+            .sort_values(column, ascending=False, kind="stable")
+            .groupby(by, sort=False)
+            .head(n)
+            .sort_values(by, kind="stable")
+            .reset_index(drop=True)
+        )
+        record["rows"] = len(top)
+    return top
 
 
 def countries_dict():
     """
     Creates a dictionary mapping country names to their numeric codes.
 
-    This function reads a CSV file containing country names and their corresponding numeric codes,
-    and returns a dictionary where the keys are country names and the values are their numeric codes.
+    This function uses the loaded index of the CSV file containing country names and their
+    corresponding numeric codes, and returns a dictionary where the keys are country names and the values are their numeric codes.
 
     Returns:
         dict: A dictionary with country names as keys and numeric codes as values.
     """
-    country_dict = {}
-    with open(countries_data, mode="r") as file:
-        reader = csv.DictReader(file)
-        country_dict = {row["Country"]: row["Numeric code"] for row in reader}
+    countries = country_index()
+    country_dict = {
+        name: str(code) for name, code in zip(countries.names, countries.codes)
+    }
     return country_dict
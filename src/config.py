@@ -0,0 +1,27 @@
+import os
+
+# Locations of the data, the generated pages and the caches. Each can be set with an
+# environment variable and defaults to the folders of this repository:
+#     MIGRATION_DATA_DIR    source data files (default: data/)
+#     MIGRATION_WWW_DIR     generated pages (default: www/)
+#     MIGRATION_CACHE_DIR   cleaned tables, chart specifications and build manifest
+#                           (default: data/cache/)
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+data_dir = os.environ.get("MIGRATION_DATA_DIR", os.path.join(repo_dir, "data"))
+www_dir = os.environ.get("MIGRATION_WWW_DIR", os.path.join(repo_dir, "www"))
+cache_dir = os.environ.get("MIGRATION_CACHE_DIR", os.path.join(data_dir, "cache"))
+
+
+def data_path(filename):
+    """
+    Returns the location of a source data file.
+
+    Args:
+        filename (str): The name of the file in the data folder.
+
+    Returns:
+        str: The path of the file.
+    """
+    return os.path.join(data_dir, filename)
@@ -1,27 +1,894 @@
-from clean import countries_dict
-from plots import migration_flow, migration_rate
-import panel as pn
+from clean import (
+    aggregates_data,
+    cache_dir,
+    clean_estimates,
+    clean_region_stock,
+    clean_sex_stock,
+    clean_total_stock,
+    countries_data,
+    enable_streaming,
+    estimates_data,
+    file_hash,
+    stock_data,
+)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from plots import (
+    WORLD_TOPOLOGY_URL,
+    YEARS,
+    migration_flow_all,
+    migration_rate_all,
+    shared_datasets,
+)
+import argparse
+import clean
+import config
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import posixpath
+import re
+import shutil
+import tracing
+import urllib.request
+import validate
 
-pn.extension("vega")
+www_dir = config.www_dir
+src_dir = os.path.dirname(os.path.abspath(__file__))
+specs_dir = os.path.join(cache_dir, "specs")
+manifest_path = os.path.join(cache_dir, "build-manifest.json")
 
-# Plots Country Page + Widgets
-select = pn.widgets.Select(
-    name="Year", options=[1990, 1995, 2000, 2005, 2010, 2015, 2020]
-)
-interactive_flow = pn.bind(migration_flow, selected_year=select)
+# Write chart data once to www/data and reference it from every year's chart, instead
+# of embedding the data pre-transformed by VegaFusion in each specification. The pages
+# then fetch the data files, so they have to be served over HTTP rather than opened
+# from disk
+shared_data = False
+shared_data_dir = os.path.join(www_dir, "data")
 
-plots_country = pn.Column(select, interactive_flow)
+# Embed one chart specification per page that holds every year's data, with a Year
+# selector filtering it in the browser, instead of one specification per year
+single_spec = False
 
-plots_country.save(
-    "/Users/paulacadena/Git-Hub/CAPP30239-IP/www/plots_country.html", embed=True
-)
+# Pruning of the connection lines of the flow charts (see migration_flow_all): the most
+# lines drawn per destination and year, and the fewest migrants drawn as a line, or None
+# to draw every line
+max_lines = None
+min_migrants = None
 
-# Plots Region Page + Widgets
+# Build pages that need no network: the world map and the JavaScript and CSS of Bokeh,
+# Panel and Vega are copied to www/vendor and loaded from there instead of from CDNs
+self_contained = False
+# Quantization of the vendored world map (e.g., 1e4 for a smaller file, set with
+# --quantize), or None to copy it unchanged
+topology_quantization = None
+vendor_dir = os.path.join(www_dir, "vendor")
+# A local copy of the world map, used instead of downloading it when present
+topology_source = config.data_path("world-110m.json")
 
-interactive_plot = pn.bind(migration_rate, selected_year=select)
-select_row = pn.Row(pn.Spacer(width=800), select, sizing_mode="stretch_width")
-plots_region = pn.Column(select_row, interactive_plot)
 
-plots_region.save(
-    "/Users/paulacadena/Git-Hub/CAPP30239-IP/www/plots_region.html", embed=True
-)
+def data_context(shared=None):
+    """Returns the context in which charts are built for the selected data mode."""
+    shared = shared_data if shared is None else shared
+    return shared_datasets(shared_data_dir) if shared else nullcontext()
+
+
+def render_spec(make_specs, year, shared):
+    """
+    Generates the chart specification for one year. Runs in the worker processes.
+
+    Args:
+        make_specs (callable): Returns the specifications keyed by year.
+        year (int): The year to render.
+        shared (bool): Whether the chart data is written to shared files.
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+    """
+    with data_context(shared):
+        return make_specs(years=[year])[year]
+
+
+def render_single_spec(make_specs, shared):
+    """
+    Generates the specification of every year. Runs in the worker processes.
+
+    Args:
+        make_specs (callable): Returns the specifications, given single=True.
+        shared (bool): Whether the chart data is written to shared files.
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+    """
+    with data_context(shared):
+        return make_specs(years=YEARS, single=True)
+
+
+def save_specs(path, make_specs, executor=None):
+    """
+    Generates the chart specifications for every year and saves them as JSON.
+
+    Args:
+        path (str): Location of the JSON file.
+        make_specs (callable): Returns the specifications keyed by year
+                               (e.g., migration_flow_all).
+        executor (ProcessPoolExecutor, optional): Pool that renders the years in
+                                                  parallel. Defaults to a single pass
+                                                  in this process.
+
+    Returns:
+        list: The files written, including the shared data files the specifications use.
+    """
+    if executor is None:
+        with data_context():
+            specs = make_specs(years=YEARS)
+    else:
+        futures = {
+            year: executor.submit(render_spec, make_specs, year, shared_data)
+            for year in YEARS
+        }
+        specs = {year: future.result() for year, future in futures.items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as file:
+        json.dump({str(year): spec for year, spec in specs.items()}, file)
+    return [path] + data_files(specs.values())
+
+
+def save_single_spec(path, make_specs, executor=None):
+    """
+    Generates one chart specification covering every year and saves it as JSON.
+
+    Args:
+        path (str): Location of the JSON file.
+        make_specs (callable): Returns the specifications, given single=True
+                               (e.g., migration_flow_all).
+        executor (ProcessPoolExecutor, optional): Pool that renders the specification
+                                                  in a worker process, as the years of
+                                                  save_specs are. Defaults to rendering
+                                                  in this process.
+
+    Returns:
+        list: The files written, including the shared data files the specification uses.
+    """
+    # Rendering changes Altair's global data transformer and chart counters, so targets
+    # built in threads at the same time must not render in this process
+    spec = _run(executor, render_single_spec, make_specs, shared_data)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as file:
+        json.dump(spec, file)
+    return [path] + data_files([spec])
+
+
+def data_files(specs):
+    """
+    Lists the shared data files referenced by chart specifications.
+
+    Args:
+        specs (iterable): Altair chart specifications in Vega format.
+
+    Returns:
+        list: The locations of the data files.
+    """
+    return sorted(
+        {
+            os.path.join(shared_data_dir, os.path.basename(dataset["url"]))
+            for spec in specs
+            for dataset in spec.get("data", [])
+            if dataset.get("url", "").startswith("data/")
+        }
+    )
+
+
+def load_specs(path):
+    """
+    Loads chart specifications saved by save_specs or save_single_spec.
+
+    Args:
+        path (str): Location of the JSON file.
+
+    Returns:
+        dict: The Altair chart specification in Vega format for each year, keyed by year,
+              or the single specification of all years.
+    """
+    with open(path, mode="r") as file:
+        specs = json.load(file)
+    if "$schema" in specs:
+        return specs
+    return {int(year): spec for year, spec in specs.items()}
+
+
+def quantize_topology(topology, quantization):
+    """
+    Rounds the coordinates of a TopoJSON topology to a grid of the given size.
+
+    Arcs are decoded to absolute coordinates, snapped to a quantization x quantization
+    grid over the bounding box, stripped of repeated points and delta-encoded again, so a
+    coarser grid gives a smaller file.
+
+    Args:
+        topology (dict): A TopoJSON topology, quantized or not.
+        quantization (int): The number of grid steps along each axis (e.g., 1e4).
+
+    Returns:
+        dict: The quantized topology.
+    """
+    transform = topology.get("transform")
+
+    def decode(arc):
+        if transform is None:
+            return [list(point[:2]) for point in arc]
+        (sx, sy), (tx, ty) = transform["scale"], transform["translate"]
+        x = y = 0
+        points = []
+        for point in arc:
+            x, y = x + point[0], y + point[1]
+            points.append([x * sx + tx, y * sy + ty])
+        return points
+
+    arcs = [decode(arc) for arc in topology["arcs"]]
+    xs = [x for arc in arcs for x, _ in arc]
+    ys = [y for arc in arcs for _, y in arc]
+    x0, y0 = min(xs), min(ys)
+    kx = (max(xs) - x0) / (quantization - 1) or 1
+    ky = (max(ys) - y0) / (quantization - 1) or 1
+
+    def encode(arc):
+        grid = [(round((x - x0) / kx), round((y - y0) / ky)) for x, y in arc]
+        kept = [grid[0]]
+        for point in grid[1:]:
+            if point != kept[-1]:
+                kept.append(point)
+        if len(kept) == 1:
+            # Arcs keep both ends, even when they fall on the same grid point
+            kept.append(kept[0])
+        deltas = [list(kept[0])]
+        for (px, py), (x, y) in zip(kept, kept[1:]):
+            deltas.append([x - px, y - py])
+        return deltas
+
+    quantized = dict(topology)
+    quantized["transform"] = {"scale": [kx, ky], "translate": [x0, y0]}
+    quantized["arcs"] = [encode(arc) for arc in arcs]
+    return quantized
+
+
+def vendor_topology(path, quantization=None):
+    """
+    Copies the world map of the flow chart next to the pages.
+
+    The map is read from topology_source when that file exists, and downloaded from
+    WORLD_TOPOLOGY_URL otherwise.
+
+    Args:
+        path (str): Location of the vendored TopoJSON file.
+        quantization (int, optional): Quantizes the map with quantize_topology. Defaults
+                                      to copying it unchanged.
+
+    Returns:
+        list: The files written.
+    """
+    if os.path.exists(topology_source):
+        with open(topology_source, mode="rb") as file:
+            topology = json.load(file)
+    else:
+        with urllib.request.urlopen(WORLD_TOPOLOGY_URL) as response:
+            topology = json.load(response)
+    if quantization is not None:
+        topology = quantize_topology(topology, quantization)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as file:
+        json.dump(topology, file, separators=(",", ":"))
+    return [path]
+
+
+def page_resources(vendored=None):
+    """Returns the Bokeh resources of saved pages: from www/vendor when self-contained, else CDN."""
+    from bokeh.resources import CDN, Resources
+
+    vendored = self_contained if vendored is None else vendored
+    if not vendored:
+        return CDN
+    # Relative to the pages, which are saved in www
+    root = os.path.relpath(vendor_dir, www_dir).replace(os.sep, "/")
+    return Resources(mode="server", root_url=f"{root}/")
+
+
+def vendor_sources():
+    """Returns the local directories that the vendored asset paths are copied from."""
+    import bokeh
+    from panel.io.resources import DIST_DIR
+
+    return {
+        "static/extensions/panel/": str(DIST_DIR),
+        "static/": os.path.join(os.path.dirname(bokeh.__file__), "server", "static"),
+    }
+
+
+def vendor_assets(path):
+    """
+    Points a saved page at www/vendor for its assets and copies them there.
+
+    The Bokeh and Panel scripts already load from www/vendor (see page_resources), but
+    Panel links its stylesheets and icons to its CDN whatever the resources, so these
+    links are rewritten. Every asset that the page or its stylesheets reference is then
+    copied from the installed bokeh and panel packages, once for all the pages.
+
+    Args:
+        path (str): Location of the HTML file.
+
+    Returns:
+        list: The files copied, and those already in www/vendor.
+    """
+    from panel.io.resources import CDN_DIST
+
+    root = os.path.relpath(vendor_dir, os.path.dirname(path)).replace(os.sep, "/")
+    with open(path) as file:
+        html = file.read().replace(CDN_DIST, f"{root}/static/extensions/panel/")
+    with open(path, mode="w") as file:
+        file.write(html)
+
+    sources = vendor_sources()
+    pending = set(re.findall(rf"{re.escape(root)}/(static/[^\"'\\\s?#]+)", html))
+    seen = set()
+    files = []
+    while pending:
+        asset = pending.pop()
+        seen.add(asset)
+        prefix = next(prefix for prefix in sources if asset.startswith(prefix))
+        source = os.path.join(sources[prefix], *asset[len(prefix) :].split("/"))
+        target = os.path.join(vendor_dir, *asset.split("/"))
+        if not os.path.exists(target):
+            # The pages are saved in parallel, so the copy is only visible once complete
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = f"{target}.{os.getpid()}.tmp"
+            shutil.copyfile(source, temporary)
+            os.replace(temporary, target)
+        files.append(target)
+        if asset.endswith(".css"):
+            # Spinners and fonts referenced relative to the stylesheet
+            with open(source, encoding="utf-8") as file:
+                references = re.findall(r"url\(\s*['\"]?([^'\")]+)", file.read())
+            for reference in references:
+                if reference.startswith(("data:", "#")) or "://" in reference:
+                    continue
+                reference = reference.split("?")[0].split("#")[0]
+                resolved = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(asset), reference)
+                )
+                if resolved.startswith("static/") and resolved not in seen:
+                    pending.add(resolved)
+    return files
+
+
+def save_panel(panel, path, vendored=None):
+    """
+    Saves a Panel layout as a page with its data embedded.
+
+    Args:
+        panel (pn.viewable.Viewable): The layout.
+        path (str): Location of the HTML file.
+        vendored (bool, optional): Whether to load the JavaScript and CSS libraries from
+                                   www/vendor. Defaults to self_contained.
+
+    Returns:
+        list: The files written.
+    """
+    vendored = self_contained if vendored is None else vendored
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tracing.stage("save", page=os.path.basename(path)):
+        panel.save(path, embed=True, resources=page_resources(vendored))
+        if vendored:
+            return [path] + vendor_assets(path)
+    return [path]
+
+
+def build_country_page(path, flow_specs, vendored=None):
+    """
+    Saves the country page: the migration flow charts with a year selector.
+
+    Args:
+        path (str): Location of the HTML file.
+        flow_specs (dict): The migration flow specification for each year, or a single
+                           specification with its own Year selector.
+        vendored (bool, optional): Whether to load the JavaScript and CSS libraries from
+                                   www/vendor. Defaults to self_contained.
+
+    Returns:
+        list: The files written.
+    """
+    import panel as pn
+
+    vendored = self_contained if vendored is None else vendored
+    pn.extension("vega", inline=vendored)
+
+    if "$schema" in flow_specs:
+        # The year is selected inside the chart
+        plots_country = pn.Column(pn.pane.Vega(flow_specs))
+    else:
+        # Plots Country Page + Widgets
+        select = pn.widgets.Select(name="Year", options=YEARS)
+        interactive_flow = pn.bind(
+            lambda selected_year: flow_specs[selected_year], selected_year=select
+        )
+
+        plots_country = pn.Column(select, interactive_flow)
+
+    return save_panel(plots_country, path, vendored)
+
+
+def build_region_page(path, rate_specs, vendored=None):
+    """
+    Saves the region page: the migration rate charts with a year selector.
+
+    Args:
+        path (str): Location of the HTML file.
+        rate_specs (dict): The migration rate specification for each year, or a single
+                           specification with its own Year selector.
+        vendored (bool, optional): Whether to load the JavaScript and CSS libraries from
+                                   www/vendor. Defaults to self_contained.
+
+    Returns:
+        list: The files written.
+    """
+    import panel as pn
+
+    vendored = self_contained if vendored is None else vendored
+    pn.extension("vega", inline=vendored)
+
+    if "$schema" in rate_specs:
+        # The year is selected inside the chart
+        plots_region = pn.Column(pn.pane.Vega(rate_specs))
+    else:
+        # Plots Region Page + Widgets
+        select = pn.widgets.Select(name="Year", options=YEARS)
+        interactive_plot = pn.bind(
+            lambda selected_year: rate_specs[selected_year], selected_year=select
+        )
+        select_row = pn.Row(pn.Spacer(width=800), select, sizing_mode="stretch_width")
+        plots_region = pn.Column(select_row, interactive_plot)
+
+    return save_panel(plots_region, path, vendored)
+
+
+def save_page(build_page, path, specs_path, vendored):
+    """
+    Saves a page from specifications saved by save_specs. Runs in the worker processes.
+
+    Args:
+        build_page (callable): Builds the page (e.g., build_country_page).
+        path (str): Location of the HTML file.
+        specs_path (str): Location of the specifications.
+        vendored (bool): Whether to load the JavaScript and CSS libraries from www/vendor.
+
+    Returns:
+        list: The files written.
+    """
+    return build_page(path, load_specs(specs_path), vendored)
+
+
+def _start_worker(table_dir, data_dir, stream):
+    """
+    Gives a worker process of the build the folders and modes of the build.
+
+    Workers start from a fresh interpreter (see build), so settings changed after import
+    in this process, such as the cache folder, are passed to them here.
+
+    Args:
+        table_dir (str): The folder of the cleaned tables cache.
+        data_dir (str): The folder of the shared data files.
+        stream (bool): Whether the stock tables are built by streaming.
+    """
+    global shared_data_dir
+    clean.cache_dir = table_dir
+    shared_data_dir = data_dir
+    if stream:
+        enable_streaming()
+
+
+def _run(executor, function, *args):
+    """Runs a function in the pool, if there is one, and waits for its result."""
+    if executor is None:
+        return function(*args)
+    return executor.submit(function, *args).result()
+
+
+def targets():
+    """
+    Describes the build as a dependency graph, from source data to HTML pages.
+
+    Each target lists its inputs (files, or the names of other targets), the file it
+    produces, the cleaned tables it reads and the function that builds it (given the
+    output path and an optional process pool). A target may also list options that
+    change its output besides its inputs, such as the validation thresholds or the build
+    modes it depends on, so a mode only rebuilds the targets it affects. Cleaned tables
+    are cached separately by the cleaners, so rebuilding specifications after a change to
+    plots.py or theme.py does not re-clean the data. The specifications depend on the validation of the data,
+    so a failed check (see validate.py) stops the build before any chart is rendered.
+
+    Returns:
+        dict: The targets keyed by name.
+    """
+    validation = os.path.join(cache_dir, "validation.json")
+    flow_specs = os.path.join(specs_dir, "flow.json")
+    rate_specs = os.path.join(specs_dir, "rate.json")
+    topology = os.path.join(vendor_dir, "world-110m.json")
+    code = {
+        name: os.path.join(src_dir, name)
+        for name in [
+            "config.py",
+            "tracing.py",
+            "clean.py",
+            "tensor.py",
+            "plots.py",
+            "theme.py",
+            "pages.py",
+            "validate.py",
+        ]
+    }
+    # Modules imported by every target
+    common = [code["config.py"], code["tracing.py"]]
+    save = save_single_spec if single_spec else save_specs
+    flow_options = {"max_lines": max_lines, "min_migrants": min_migrants}
+    make_flow_specs = functools.partial(migration_flow_all, **flow_options)
+    if self_contained:
+        # The URL is relative to the page, as for the shared data files
+        make_flow_specs = functools.partial(
+            make_flow_specs,
+            topology_url=os.path.relpath(topology, www_dir).replace(os.sep, "/"),
+        )
+    graph = {
+        "validation": {
+            "inputs": [
+                stock_data,
+                countries_data,
+                aggregates_data,
+                code["clean.py"],
+                code["validate.py"],
+            ]
+            + common,
+            "output": validation,
+            "options": validate.current_thresholds(),
+            "tables": [clean_total_stock, clean_sex_stock, validate.stock_anomalies],
+            "build": lambda output, executor: validate.save_report(output),
+        },
+        "topology": {
+            "inputs": [source for source in [topology_source] if os.path.exists(source)]
+            + [code["pages.py"]]
+            + common,
+            "output": topology,
+            "options": {"topology_quantization": topology_quantization},
+            "tables": [],
+            "build": lambda output, executor: vendor_topology(
+                output, topology_quantization
+            ),
+        },
+        "flow-specs": {
+            "inputs": [
+                stock_data,
+                countries_data,
+                code["clean.py"],
+                code["tensor.py"],
+                code["plots.py"],
+                code["theme.py"],
+                "validation",
+            ]
+            + common
+            + (["topology"] if self_contained else []),
+            "output": flow_specs,
+            "options": dict(
+                flow_options,
+                shared_data=shared_data,
+                single_spec=single_spec,
+                self_contained=self_contained,
+            ),
+            "tables": [clean_total_stock, clean_sex_stock],
+            "build": lambda output, executor: save(output, make_flow_specs, executor),
+        },
+        "rate-specs": {
+            "inputs": [
+                stock_data,
+                estimates_data,
+                countries_data,
+                aggregates_data,
+                code["clean.py"],
+                code["plots.py"],
+                code["theme.py"],
+                "validation",
+            ]
+            + common,
+            "output": rate_specs,
+            "options": {"shared_data": shared_data, "single_spec": single_spec},
+            "tables": [clean_estimates, clean_region_stock],
+            "build": lambda output, executor: save(
+                output, migration_rate_all, executor
+            ),
+        },
+        "country": {
+            "inputs": ["flow-specs", code["pages.py"]] + common,
+            "output": os.path.join(www_dir, "plots_country.html"),
+            "options": {"self_contained": self_contained},
+            "tables": [],
+            "build": lambda output, executor: _run(
+                executor,
+                save_page,
+                build_country_page,
+                output,
+                flow_specs,
+                self_contained,
+            ),
+        },
+        "region": {
+            "inputs": ["rate-specs", code["pages.py"]] + common,
+            "output": os.path.join(www_dir, "plots_region.html"),
+            "options": {"self_contained": self_contained},
+            "tables": [],
+            "build": lambda output, executor: _run(
+                executor,
+                save_page,
+                build_region_page,
+                output,
+                rate_specs,
+                self_contained,
+            ),
+        },
+    }
+    if not self_contained:
+        del graph["topology"]
+    return graph
+
+
+def build(names, force=False, jobs=1, verbose=False):
+    """
+    Builds targets and their dependencies, skipping those whose inputs are unchanged.
+
+    A target is rebuilt when the fingerprint of its inputs (file hashes, dependency
+    outputs and its options) differs from the last build recorded in the manifest,
+    or when one of the files it produced is missing.
+
+    With several jobs, targets that do not depend on each other are built at the same
+    time, and the years of each chart are rendered in a pool of processes. The cleaned
+    tables are prepared once beforehand, so the workers read them from the on-disk cache.
+    When profiling (see tracing.profile), the build is serial whatever the jobs.
+
+    Args:
+        names (list): The targets to build.
+        force (bool): Whether to rebuild every target regardless of its inputs.
+        jobs (int): The number of worker processes. Defaults to 1 (serial build).
+        verbose (bool): Whether to print the name of each target as it is built.
+                        Defaults to False.
+
+    Returns:
+        list: The names of the targets that were rebuilt.
+    """
+    graph = targets()
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, mode="r") as file:
+            manifest = json.load(file)
+    rebuilt = []
+
+    # Group the targets in levels, each after the levels of its dependencies
+    def depth(name):
+        dependencies = [source for source in graph[name]["inputs"] if source in graph]
+        return 1 + max((depth(source) for source in dependencies), default=-1)
+
+    def requirements(name):
+        dependencies = [source for source in graph[name]["inputs"] if source in graph]
+        return {name}.union(*(requirements(source) for source in dependencies))
+
+    levels = {}
+    for name in set().union(*(requirements(name) for name in names)):
+        levels.setdefault(depth(name), []).append(name)
+
+    def fingerprint(name):
+        digest = hashlib.sha256(name.encode())
+        digest.update(
+            json.dumps(graph[name].get("options", {}), sort_keys=True).encode()
+        )
+        for source in graph[name]["inputs"]:
+            if source in graph:
+                source = graph[source]["output"]
+            digest.update(file_hash(source).encode())
+        return digest.hexdigest()
+
+    def stale(name):
+        record = manifest.get(name, {})
+        return (
+            force
+            or record.get("fingerprint") != fingerprint(name)
+            or not all(os.path.exists(path) for path in record.get("outputs", []))
+            or not os.path.exists(graph[name]["output"])
+        )
+
+    def save_manifest():
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, mode="w") as file:
+            json.dump(manifest, file, indent=2)
+
+    # One profile of the whole build, which must then run serially: a profiler only sees
+    # its own thread, not the worker processes, and Python 3.12 allows one at a time
+    if tracing.profiling():
+        jobs = 1
+    # Workers are not forked: a fork of a process that has already rendered a chart
+    # inherits the runtime of vl-convert in a state where rendering never returns
+    pool = functools.partial(
+        ProcessPoolExecutor,
+        jobs,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=_start_worker,
+        initargs=(clean.cache_dir, shared_data_dir, clean.streaming),
+    )
+    with tracing.profile("build"), pool() if jobs > 1 else nullcontext() as executor:
+
+        def run(name):
+            if verbose:
+                print(f"Building {name}")
+            # Forget the last build first, so a target that fails is built again next time
+            manifest.pop(name, None)
+            with tracing.stage("target", target=name):
+                outputs = graph[name]["build"](graph[name]["output"], executor)
+            manifest[name] = {"fingerprint": fingerprint(name), "outputs": outputs}
+            rebuilt.append(name)
+
+        try:
+            for level in sorted(levels):
+                names_to_build = sorted(name for name in levels[level] if stale(name))
+                if executor is None:
+                    for name in names_to_build:
+                        run(name)
+                else:
+                    # Fill the on-disk cache once instead of cleaning in every worker
+                    for name in names_to_build:
+                        for table in graph[name]["tables"]:
+                            table()
+                    with ThreadPoolExecutor(max(len(names_to_build), 1)) as threads:
+                        list(threads.map(run, names_to_build))
+        except BaseException:
+            # Keep the targets built before the failure
+            save_manifest()
+            raise
+
+    save_manifest()
+
+    # Remove shared data files no longer referenced by any target
+    if os.path.isdir(shared_data_dir):
+        referenced = {
+            path for record in manifest.values() for path in record["outputs"]
+        }
+        for filename in os.listdir(shared_data_dir):
+            path = os.path.join(shared_data_dir, filename)
+            if filename.endswith(".json") and path not in referenced:
+                os.remove(path)
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the chart pages in www/, rebuilding only what changed."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        metavar="target",
+        help="Targets to build: country, region, flow-specs, rate-specs or validation "
+        "(default: both pages).",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Rebuild targets even if up to date."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for rendering years and pages (default: 1).",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help="Write the timing, rows and memory of every stage as JSON lines to PATH "
+        "(default: stderr).",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Save a cProfile dump of the build to DIR/build.prof. The build is then "
+        "serial, so -j cannot be used.",
+    )
+    parser.add_argument(
+        "--self-contained",
+        action="store_true",
+        help="Copy the world map and the JavaScript and CSS libraries to www/vendor, "
+        "so the pages load without network access.",
+    )
+    parser.add_argument(
+        "--quantize",
+        type=float,
+        metavar="N",
+        help="With --self-contained, store the world map on an N x N grid (e.g. 1e4), "
+        "for a smaller file with coarser borders (default: unchanged).",
+    )
+    parser.add_argument(
+        "--single-spec",
+        action="store_true",
+        help="Embed one chart per page holding every year, with the year selected in "
+        "the browser.",
+    )
+    parser.add_argument(
+        "--max-lines",
+        type=int,
+        metavar="N",
+        help="Draw at most N connection lines per country and year in the flow charts, "
+        "keeping the origins with the most migrants (default: all).",
+    )
+    parser.add_argument(
+        "--min-migrants",
+        type=int,
+        metavar="N",
+        help="Draw connection lines in the flow charts only for at least N migrants "
+        "(default: all).",
+    )
+    parser.add_argument(
+        "--shared-data",
+        action="store_true",
+        help="Write the chart data once to www/data and reference it from every "
+        "year's chart instead of embedding it. The pages must then be served over HTTP.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read the stock workbook row by row when cleaning it, which bounds the "
+        "peak memory but is slower.",
+    )
+    parser.add_argument(
+        "--threshold",
+        action="append",
+        default=[],
+        metavar="CHECK=VALUE",
+        help="Override the threshold of a data check, e.g. 'negative stocks=10' "
+        "(see validate.py). Can be repeated.",
+    )
+    args = parser.parse_args()
+    global self_contained, shared_data, single_spec, max_lines, min_migrants
+    global topology_quantization
+    if args.quantize is not None and not args.self_contained:
+        parser.error("--quantize only applies with --self-contained")
+    if args.quantize is not None and args.quantize < 2:
+        parser.error("--quantize needs a grid of at least 2 x 2")
+    self_contained = args.self_contained
+    topology_quantization = None if args.quantize is None else int(args.quantize)
+    shared_data = args.shared_data
+    single_spec = args.single_spec
+    max_lines = args.max_lines
+    min_migrants = args.min_migrants
+    if args.profile and args.jobs > 1:
+        parser.error("--profile builds serially and cannot be used with -j")
+    if args.trace or args.profile:
+        tracing.enable(args.trace, profile_dir=args.profile)
+    if args.stream:
+        enable_streaming()
+    for threshold in args.threshold:
+        check, _, value = threshold.rpartition("=")
+        try:
+            validate.set_threshold(check.strip(), float(value))
+        except ValueError as error:
+            parser.error(f"invalid threshold {threshold!r}: {error}")
+    unknown = set(args.targets) - set(targets())
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(sorted(unknown))}")
+    try:
+        build(
+            args.targets or ["country", "region"],
+            force=args.force,
+            jobs=args.jobs,
+            verbose=True,
+        )
+    except validate.ValidationError as error:
+        parser.exit(1, f"{error}\n")
+
+
+if __name__ == "__main__":
+    main()
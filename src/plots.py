@@ -1,80 +1,464 @@
-import altair as alt
+import copy
+import functools
+import hashlib
+import json
+import os
 import pandas as pd
-from vega_datasets import data
+import threading
+import tracing
+from clean import (
+    AGGREGATE_LEVELS,
+    OTHER_ORIGIN,
+    YEARS,
+    clean_area_stock,
+    clean_total_stock,
+    clean_estimates,
+    clean_flow_totals,
+    clean_growth_metrics,
+    clean_region_stock,
+    clean_sex_stock,
+    country_index,
+    flow_stock_comparison,
+    subregion_stock,
+    top_n,
+)
+from tensor import StockTensor
 
-alt.data_transformers.enable("vegafusion")
-from clean import clean_total_stock, clean_estimates, clean_region_stock
-from theme import custom_theme
 
-alt.themes.register("custom_theme", custom_theme)
-alt.themes.enable("custom_theme")
+@functools.cache
+def altair():
+    """
+    Imports Altair and sets it up for the charts, the first time a chart is built.
+
+    Altair, VegaFusion and the theme are only loaded when needed, so importing plots
+    (e.g., for YEARS or the server helpers) does not pull in the visualization stack.
+
+    Returns:
+        module: The altair module, with the VegaFusion data transformer and the custom
+                theme enabled and the shared_json data transformer registered.
+    """
+    import altair as alt
+    from theme import custom_theme
+
+    alt.data_transformers.register("shared_json", shared_json)
+    alt.data_transformers.enable("vegafusion")
+
+    # Report the VegaFusion transform as its own stage of to_dict when tracing. This
+    # wraps a private function of Altair, so it is left alone if Altair renames it.
+    api = alt.vegalite.v5.api
+    if tracing.enabled() and hasattr(api, "_compile_with_vegafusion"):
+        compile_with_vegafusion = api._compile_with_vegafusion
+
+        def traced_compile_with_vegafusion(vegalite_spec):
+            with tracing.stage("vegafusion"):
+                return compile_with_vegafusion(vegalite_spec)
+
+        api._compile_with_vegafusion = traced_compile_with_vegafusion
+
+    alt.themes.register("custom_theme", custom_theme)
+    alt.themes.enable("custom_theme")
+    return alt
+
+
+# World map used by the flow chart (vega_datasets.data.world_110m.url)
+WORLD_TOPOLOGY_URL = (
+    "https://cdn.jsdelivr.net/npm/vega-datasets@v1.29.0/data/world-110m.json"
+)
+
+
+def shared_json(data, directory, urlpath="data"):
+    """
+    Altair data transformer that writes each dataset to a file named by its contents.
+
+    Identical datasets (e.g., the country lookup table used by every year's chart) are
+    written once and referenced by all specifications instead of being embedded in each.
+
+    Args:
+        data (pd.DataFrame): The chart data.
+        directory (str): Folder where the data files are written.
+        urlpath (str): URL of the folder, relative to the saved page. Defaults to 'data'.
+
+    Returns:
+        dict: A URL-based data model pointing to the data file.
+    """
+    values = json.dumps(altair().to_values(data)["values"], separators=(",", ":"))
+    filename = f"{hashlib.sha256(values.encode()).hexdigest()[:16]}.json"
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        # Write to a temporary file first, as parallel builds may write the same file
+        with open(f"{path}.{os.getpid()}.tmp", mode="w") as file:
+            file.write(values)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    return {"url": f"{urlpath}/{filename}", "format": {"type": "json"}}
+
+
+def _reset_chart_names():
+    """
+    Restarts Altair's numbering of parameters and views (param_1, view_1, ...).
+
+    Each chart is then named the same way no matter how many charts the process built
+    before, so specifications are identical whether years are rendered together or in
+    separate processes.
+    """
+    alt = altair()
+    alt.Parameter._counter = 0
+    alt.Chart._counter = 0
+
+
+def shared_datasets(directory, urlpath="data"):
+    """
+    Makes the charts built inside the context reference shared external data files.
+
+    Inside the context, chart data is written with shared_json instead of being
+    pre-transformed by VegaFusion and inlined, so transforms run in the browser.
+
+    Args:
+        directory (str): Folder where the data files are written.
+        urlpath (str): URL of the folder, relative to the saved page. Defaults to 'data'.
+
+    Returns:
+        A context manager that restores the previous data transformer on exit.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return altair().data_transformers.enable(
+        "shared_json", directory=directory, urlpath=urlpath
+    )
 
 
-def migration_flow(selected_year=1990):
+def migration_flow(
+    selected_year=1990,
+    n_origins=5,
+    max_lines=None,
+    min_migrants=None,
+    all_years=False,
+):
     """
     Generates an interactive Altair visualization for migration flow in a selected year.
 
     This function creates:
     - A world map showing total immigrants for each destination country.
     - Connection lines indicating migration flows from origin to destination countries.
-    - A bar chart highlighting the top 5 origin countries for a selected destination country.
+    - A bar chart highlighting the top origin countries for a selected destination country.
 
     Args:
         selected_year (int): The year to filter migration data. Defaults to 1990.
+        n_origins (int): The number of origin countries in the bar chart. Defaults to 5.
+        max_lines (int, optional): The largest number of connection lines per destination,
+                                   keeping the origins with the most migrants.
+        min_migrants (int, optional): The smallest migrant stock drawn as a connection line.
+        all_years (bool): Whether to include the data of every year in one specification,
+                          with a Year selector starting at selected_year that filters the
+                          charts in the browser. Defaults to False.
 
     Returns:
         dict: The Altair chart specification in Vega format.
 
+    """
+    if all_years:
+        return migration_flow_all(
+            n_origins=n_origins,
+            max_lines=max_lines,
+            min_migrants=min_migrants,
+            single=True,
+            selected_year=selected_year,
+        )
+    return migration_flow_all(
+        years=[selected_year],
+        n_origins=n_origins,
+        max_lines=max_lines,
+        min_migrants=min_migrants,
+    )[selected_year]
+
+
+def migration_flow_all(
+    years=YEARS,
+    n_origins=5,
+    max_lines=None,
+    min_migrants=None,
+    total_stock=None,
+    topology_url=None,
+    sex_stock=None,
+    single=False,
+    selected_year=None,
+):
+    """
+    Generates the migration flow visualization for several years in one pass.
+
+    The data is loaded and cleaned once. The destination totals and top origins are
+    computed for every year on a StockTensor of the migration stock, and the totals by sex
+    and connection lines with a single groupby over 'Year'. Each year's chart is then built from slices of these shared results, or,
+    with single, one chart is built from all of them with a Year selector.
+
+    Args:
+        years (list): The years to generate charts for. Defaults to all available years.
+        n_origins (int): The number of origin countries in the bar chart. Defaults to 5.
+        max_lines (int, optional): The largest number of connection lines per destination,
+                                   keeping the origins with the most migrants.
+        min_migrants (int, optional): The smallest migrant stock drawn as a connection line.
+        total_stock (pd.DataFrame, optional): Cleaned migration stock data, if already
+                                              loaded. Defaults to clean_total_stock().
+        topology_url (str, optional): URL of the world TopoJSON file, e.g. a copy next to
+                                      the page. Defaults to the vega-datasets URL.
+        sex_stock (pd.DataFrame, optional): Cleaned migration stock data by sex, if
+                                            already loaded. Defaults to clean_sex_stock().
+        single (bool): Whether to build one specification for all the years, filtered by
+                       a Year selector in the browser. Defaults to False.
+        selected_year (int, optional): The year first shown by the single specification.
+                                       Defaults to the first year.
+
+    Returns:
+        dict: The Altair chart specification in Vega format for each year, keyed by year,
+              or the single specification.
+
     """
     # Load data and filter for map
-    total_stock = clean_total_stock()
-    total_stock.drop(
-        total_stock[total_stock["Origin code"] == 2003].index, inplace=True
+    if total_stock is None:
+        total_stock = clean_total_stock()
+    total_stock = total_stock[
+        (total_stock["Origin code"] != OTHER_ORIGIN) & total_stock["Year"].isin(years)
+    ]
+    countries = country_index()
+    with tracing.stage("tensor", table="total stock"):
+        stock = StockTensor.from_long(total_stock)
+
+    # Total immigrants by destination for every year, placed at the destination
+    with tracing.stage("totals", table="total immigrants") as record:
+        total_stock_aggregated = stock.all_totals()
+        record["rows"] = len(total_stock_aggregated)
+    # Immigrants of each sex by destination, shown by the Male/Female toggle of the map
+    if sex_stock is None:
+        sex_stock = clean_sex_stock()
+    sex_stock = sex_stock[
+        (sex_stock["Origin code"] != OTHER_ORIGIN) & sex_stock["Year"].isin(years)
+    ]
+    with tracing.stage("groupby", table="immigrants by sex") as record:
+        sex_aggregated = (
+            sex_stock.groupby(["Year", "Destination code", "Sex"], observed=True)[
+                "Migration"
+            ]
+            .sum()
+            .unstack("Sex")
+            .reindex(columns=["Male", "Female"])
+        )
+        record["rows"] = len(sex_aggregated)
+    total_stock_aggregated = total_stock_aggregated.join(
+        sex_aggregated, on=["Year", "Destination code"]
+    )
+    total_stock_aggregated = total_stock_aggregated[
+        countries.contains(total_stock_aggregated["Destination code"])
+    ]
+    destination_codes = total_stock_aggregated["Destination code"]
+    total_stock_aggregated = total_stock_aggregated.assign(
+        Country=countries.take(countries.names, destination_codes),
+        latitude=countries.take(countries.latitude, destination_codes),
+        longitude=countries.take(countries.longitude, destination_codes),
     )
-    countries = pd.read_csv(
-        "/Users/paulacadena/Git-Hub/CAPP30239-IP/data/country-coord.csv"
+
+    # Connection lines with the coordinates of both ends, sorted by destination
+    connection_lines = connections_table(
+        total_stock, countries, max_lines=max_lines, min_migrants=min_migrants
+    )
+
+    # Additional filter for bars chart, for every year
+    with tracing.stage("top_n", table="top origins", n=n_origins) as record:
+        top_countries_aggregated = stock.all_top_origins(n=n_origins)
+        record["rows"] = len(top_countries_aggregated)
+
+    top_countries_aggregated["Country"] = countries.take(
+        countries.names, top_countries_aggregated["Origin code"], fill=None
     )
-    countries.rename(
-        columns={"Latitude (average)": "latitude", "Longitude (average)": "longitude"},
-        inplace=True,
+
+    if single:
+        with tracing.stage("chart", chart="flow", year="all"):
+            return _flow_chart(
+                total_stock_aggregated,
+                connection_lines,
+                top_countries_aggregated,
+                topology_url=topology_url,
+                years=years,
+                selected_year=selected_year,
+            )
+
+    aggregated_by_year = dict(list(total_stock_aggregated.groupby("Year")))
+    lines_by_year = dict(list(connection_lines.groupby("Year")))
+    top_by_year = dict(list(top_countries_aggregated.groupby("Year")))
+
+    # A year without data (e.g., 1991) gets an empty chart, and a year loses all its
+    # lines when they are pruned by min_migrants or max_lines
+    no_aggregated = total_stock_aggregated.iloc[:0]
+    no_lines = connection_lines.iloc[:0]
+    no_top = top_countries_aggregated.iloc[:0]
+
+    specs = {}
+    for year in years:
+        with tracing.stage("chart", chart="flow", year=year):
+            specs[year] = _flow_chart(
+                aggregated_by_year.get(year, no_aggregated).drop(columns="Year"),
+                lines_by_year.get(year, no_lines).drop(columns="Year"),
+                top_by_year.get(year, no_top).drop(columns="Year"),
+                topology_url=topology_url,
+            )
+    return specs
+
+
+def connections_table(total_stock, countries, max_lines=None, min_migrants=None):
+    """
+    Joins the coordinates of destination and origin to each migration pair.
+
+    The lines can be pruned to the origins with the most migrants for each destination
+    and to a minimum number of migrants, so the chart only has to filter a small table
+    that is already joined.
+
+    Args:
+        total_stock (pd.DataFrame): Migration stock by year, origin and destination.
+        countries (CountryIndex): The countries and their coordinates.
+        max_lines (int, optional): The largest number of lines per destination and year.
+        min_migrants (int, optional): The smallest migrant stock drawn as a line.
+
+    Returns:
+        pd.DataFrame: One row per line with the columns 'Year', 'Destination code',
+                      'latitude', 'longitude', 'lat2' and 'lon2', sorted by year and
+                      destination.
+    """
+    lines = total_stock[["Year", "Destination code", "Origin code", "Migration"]]
+    if min_migrants is not None:
+        lines = lines[lines["Migration"] >= min_migrants]
+    if max_lines is not None:
+        lines = top_n(lines, ["Year", "Destination code"], "Migration", n=max_lines)
+
+    lines = lines[
+        countries.contains(lines["Destination code"])
+        & countries.contains(lines["Origin code"])
+    ]
+    destinations = countries.ids(lines["Destination code"])
+    origins = countries.ids(lines["Origin code"])
+    lines = lines.assign(
+        latitude=countries.latitude[destinations],
+        longitude=countries.longitude[destinations],
+        lat2=countries.latitude[origins],
+        lon2=countries.longitude[origins],
     )
+    return lines.sort_values(["Year", "Destination code"], kind="stable")[
+        ["Year", "Destination code", "latitude", "longitude", "lat2", "lon2"]
+    ]
+
+
+def _flow_chart(
+    total_stock_aggregated,
+    connection_lines,
+    top_countries_aggregated,
+    topology_url=None,
+    years=None,
+    selected_year=None,
+):
+    """
+    Builds the migration flow visualization from one year's precomputed tables.
 
-    source = alt.topo_feature(data.world_110m.url, "countries")
+    With years, the tables hold every year (in a 'Year' column) and a Year selector
+    filters them in the browser, so switching years does not need another specification.
+
+    Args:
+        total_stock_aggregated (pd.DataFrame): Total immigrants, immigrants of each sex
+                                               ('Male' and 'Female'), name and
+                                               coordinates of each destination for the
+                                               year.
+        connection_lines (pd.DataFrame): Coordinates of the lines for the year.
+        top_countries_aggregated (pd.DataFrame): Top origin countries by destination for the year.
+        topology_url (str, optional): URL of the world TopoJSON file. Defaults to
+                                      WORLD_TOPOLOGY_URL.
+        years (list, optional): The years in the tables, offered by the Year selector.
+                                Defaults to a single year without selector.
+        selected_year (int, optional): The year first selected. Defaults to the first year.
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+
+    """
+    alt = altair()
+    _reset_chart_names()
+    source = alt.topo_feature(topology_url or WORLD_TOPOLOGY_URL, "countries")
 
     select_country = alt.selection_point(
         on="pointerover", nearest=True, fields=["Destination code"], empty=False
     )
-
-    lookup_data = alt.LookupData(
-        countries, key="Numeric code", fields=["Country", "latitude", "longitude"]
+    # Toggle between the precomputed totals of each sex, evaluated in the browser
+    select_sex = alt.param(
+        name="sex",
+        value="Immigrants",
+        bind=alt.binding_radio(
+            options=["Immigrants", "Male", "Female"],
+            labels=["Total", "Male", "Female"],
+            name="Sex ",
+        ),
     )
 
-    total_stock_filtered = total_stock[total_stock["Year"] == selected_year]
+    # Map colors, looked up by country: one field per sex, or per sex and year
+    immigrants = total_stock_aggregated
+    lookup_fields = ["Immigrants", "Male", "Female"]
+    shown = "datum[sex]"
+    select_year = None
+    if years is not None:
+        select_year = alt.param(
+            name="selected_year",
+            value=years[0] if selected_year is None else selected_year,
+            bind=alt.binding_select(options=list(years), name="Year "),
+        )
+        immigrants = total_stock_aggregated.pivot(
+            index="Destination code",
+            columns="Year",
+            values=["Immigrants", "Male", "Female"],
+        )
+        immigrants.columns = [f"{field} {year}" for field, year in immigrants.columns]
+        lookup_fields = list(immigrants.columns)
+        immigrants = immigrants.reset_index()
+        shown = "datum[sex + ' ' + selected_year]"
+
+    def in_year(chart):
+        if select_year is None:
+            return chart
+        return chart.transform_filter(alt.datum.Year == select_year)
 
-    total_stock_aggregated = total_stock_filtered.groupby(
-        "Destination code", as_index=False
-    ).agg(Migrants=("Migration", "sum"))
+    line_filter = select_country
+    if select_year is not None:
+        # Most lines are drawn in every year, so each line is kept once with the years it
+        # is drawn in as bits of 'Years' (1 for the first year, 2 for the second, ...)
+        year_bits = {year: 1 << bit for bit, year in enumerate(years)}
+        connection_lines = connection_lines.drop_duplicates()
+        connection_lines = (
+            connection_lines.assign(Years=connection_lines["Year"].map(year_bits))
+            .groupby(
+                ["Destination code", "latitude", "longitude", "lat2", "lon2"],
+                as_index=False,
+                sort=False,
+            )["Years"]
+            .sum()
+        )
+        line_filter = f"datum.Years & pow(2, indexof({list(years)}, selected_year))"
 
     # Background map
     background = (
         alt.Chart(source)
         .mark_geoshape(stroke="white")
-        .encode(
-            color=alt.Color("Migrants:Q", legend=alt.Legend(title="Total Immigrants"))
-        )
+        .encode(color=alt.Color("Shown:Q", legend=alt.Legend(title="Immigrants")))
         .transform_lookup(
             lookup="id",
             from_=alt.LookupData(
-                total_stock_aggregated, key="Destination code", fields=["Migrants"]
+                immigrants,
+                key="Destination code",
+                fields=lookup_fields,
             ),
         )
+        .transform_calculate(Shown=shown)
+        .add_params(select_sex)
         .properties(width=800, height=450)
         .project("equalEarth")
     )
+    if select_year is not None:
+        background = background.add_params(select_year)
 
     # Lines that connect destination to origin
     connections = (
-        alt.Chart(total_stock_filtered)
+        alt.Chart(connection_lines)
         .mark_rule(opacity=0.4, color="#aa4a52")
         .encode(
             latitude="latitude:Q",
@@ -82,51 +466,32 @@ def migration_flow(selected_year=1990):
             latitude2="lat2:Q",
             longitude2="lon2:Q",
         )
-        .transform_lookup(lookup="Destination code", from_=lookup_data)
-        .transform_lookup(
-            lookup="Origin code", from_=lookup_data, as_=["Country", "lat2", "lon2"]
-        )
-        .transform_filter(select_country)
+        .transform_filter(line_filter)
     )
+    if select_year is not None:
+        connections = connections.transform_filter(select_country)
     # Points to center the connections
     points = (
-        alt.Chart(total_stock_filtered)
+        in_year(alt.Chart(total_stock_aggregated))
         .mark_circle(size=0)
         .encode(
             latitude="latitude:Q",
             longitude="longitude:Q",
             order=alt.Order("Immigrants:Q").sort("descending"),
-            tooltip=[alt.Tooltip("Country:N"), alt.Tooltip("Immigrants:Q", format=",")],
+            tooltip=[
+                alt.Tooltip("Country:N"),
+                alt.Tooltip("Immigrants:Q", format=","),
+                alt.Tooltip("Male:Q", format=","),
+                alt.Tooltip("Female:Q", format=","),
+            ],
         )
-        .transform_aggregate(Immigrants="sum(Migration)", groupby=["Destination code"])
-        .transform_lookup(lookup="Destination code", from_=lookup_data)
         .add_params(select_country)
         .interactive()
     )
 
-    # Additional filter for bars chart
-    top_countries = (
-        total_stock_filtered.groupby(["Origin code", "Destination code"])
-        .agg(Immigrants=("Migration", "sum"))
-        .reset_index()
-    )
-
-    top_countries_aggregated = (
-        top_countries.groupby("Destination code")
-        .apply(lambda x: x.nlargest(5, "Immigrants"))
-        .reset_index(drop=True)
-    )
-
-    top_countries_aggregated = top_countries_aggregated.merge(
-        countries[["Numeric code", "Country"]],
-        left_on="Origin code",
-        right_on="Numeric code",
-        how="left",
-    )
-
-    # Bars chart with top 5 origin countries by destination
+    # Bars chart with top origin countries by destination
     bars = (
-        alt.Chart(top_countries_aggregated)
+        in_year(alt.Chart(top_countries_aggregated))
         .mark_bar()
         .encode(
             x=alt.X("Immigrants:Q", title="Total Immigrants"),
@@ -137,10 +502,11 @@ def migration_flow(selected_year=1990):
         .properties(width=500, height=350)
     )
 
-    return (background + connections + points | bars).to_dict(format="vega")
+    with tracing.stage("to_dict"):
+        return (background + connections + points | bars).to_dict(format="vega")
 
 
-def migration_rate(selected_year=1990):
+def migration_rate(selected_year=1990, all_years=False):
     """
     Generates an interactive visualization for migration rates and immigration data by subregion.
 
@@ -150,16 +516,101 @@ def migration_rate(selected_year=1990):
 
     Args:
         selected_year (int): The year to filter immigration data for the bar chart. Defaults to 1990.
+        all_years (bool): Whether to include the data of every year in one specification,
+                          with a Year selector starting at selected_year that filters the
+                          bar chart in the browser. Defaults to False.
 
     Returns:
         dict: The Altair chart specification in Vega format.
 
+    """
+    if all_years:
+        return migration_rate_all(single=True, selected_year=selected_year)
+    return migration_rate_all(years=[selected_year])[selected_year]
+
+
+def migration_rate_all(
+    years=YEARS,
+    estimates=None,
+    region_stock=None,
+    grouping="SDG region",
+    single=False,
+    selected_year=None,
+):
+    """
+    Generates the migration rate visualization for several years in one pass.
+
+    The estimates and regional stock data are loaded and cleaned once, and each year's
+    chart is built from a slice of the shared regional stock table, or, with single, one
+    chart is built from the whole table with a Year selector.
+
+    Args:
+        years (list): The years to generate charts for. Defaults to all available years.
+        estimates (pd.DataFrame, optional): Cleaned estimates, if already loaded.
+                                            Defaults to clean_estimates().
+        region_stock (pd.DataFrame, optional): Cleaned regional stock, if already loaded.
+                                               Defaults to clean_region_stock(), or to
+                                               subregion_stock(grouping).
+        grouping (str): The aggregate level of the origins in the bar chart, one of
+                        AGGREGATE_LEVELS. Defaults to 'SDG region'.
+        single (bool): Whether to build one specification for all the years, filtered by
+                       a Year selector in the browser. Defaults to False.
+        selected_year (int, optional): The year first shown by the single specification.
+                                       Defaults to the first year.
+
+    Returns:
+        dict: The Altair chart specification in Vega format for each year, keyed by year,
+              or the single specification.
+
     """
     # Load and filter data
-    estimates = clean_estimates()
-    region_stock = clean_region_stock()
-    region_stock = region_stock[region_stock["Year"] == selected_year]
+    if estimates is None:
+        estimates = clean_estimates()
+    if region_stock is None:
+        if grouping == "SDG region":
+            region_stock = clean_region_stock()
+        else:
+            region_stock = subregion_stock(grouping)
+    region_stock = region_stock[region_stock["Year"].isin(years)]
+    if single:
+        with tracing.stage("chart", chart="rate", year="all"):
+            return _rate_chart(
+                estimates, region_stock, years=years, selected_year=selected_year
+            )
+    region_stock_by_year = dict(list(region_stock.groupby("Year")))
+    # A year without data (e.g., 1991) gets an empty bar chart
+    no_region_stock = region_stock.iloc[:0]
+
+    specs = {}
+    for year in years:
+        with tracing.stage("chart", chart="rate", year=year):
+            specs[year] = _rate_chart(
+                estimates, region_stock_by_year.get(year, no_region_stock)
+            )
+    return specs
+
 
+def _rate_chart(estimates, region_stock, years=None, selected_year=None):
+    """
+    Builds the migration rate visualization from the estimates and one year's regional stock.
+
+    With years, the regional stock holds every year and a Year selector filters the bar
+    chart in the browser.
+
+    Args:
+        estimates (pd.DataFrame): Net migration rate estimates by subregion and year.
+        region_stock (pd.DataFrame): Migration stock between subregions for the year.
+        years (list, optional): The years in the regional stock, offered by the Year
+                                selector. Defaults to a single year without selector.
+        selected_year (int, optional): The year first selected. Defaults to the first year.
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+
+    """
+
+    alt = altair()
+    _reset_chart_names()
     selection = alt.selection_point(fields=["Subregion"], bind="legend")
 
     # Base chart for migration rate over time
@@ -196,4 +647,285 @@ def migration_rate(selected_year=1990):
         .transform_filter(selection)
         .properties(width=340, height=350)
     )
-    return (points + lines | bars).to_dict(format="vega")
+    if years is not None:
+        select_year = alt.param(
+            name="selected_year",
+            value=years[0] if selected_year is None else selected_year,
+            bind=alt.binding_select(options=list(years), name="Year "),
+        )
+        bars = bars.transform_filter(alt.datum.Year == select_year).add_params(
+            select_year
+        )
+    with tracing.stage("to_dict"):
+        return (points + lines | bars).to_dict(format="vega")
+
+
+def migration_growth(selected_year=2020, level="Destination", n=15, metrics=None):
+    """
+    Generates a bar chart of the largest changes in migration stock since 1990.
+
+    The bars show the change since 1990 of the n countries (or pairs) that gained the most
+    migrants up to the selected year, colored by their compound annual growth rate, with
+    the stock and share of the total in the tooltip. The metrics are read from the cached
+    table of clean_growth_metrics, so no differences are computed here.
+
+    Args:
+        selected_year (int): The last year of the change. Defaults to 2020.
+        level (str): 'Destination' (immigrants by country of destination), 'Origin'
+                     (emigrants by country of origin) or 'Pair'. Defaults to 'Destination'.
+        n (int): The number of bars. Defaults to 15.
+        metrics (pd.DataFrame, optional): Growth metrics, if already loaded. Defaults to
+                                          clean_growth_metrics().
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+
+    Raises:
+        ValueError: If level is not one of 'Destination', 'Origin' or 'Pair'.
+
+    """
+    if level not in ("Destination", "Origin", "Pair"):
+        raise ValueError(
+            f"Unknown level {level!r}, expected 'Destination', 'Origin' or 'Pair'"
+        )
+    if metrics is None:
+        metrics = clean_growth_metrics()
+    metrics = metrics[(metrics["Level"] == level) & (metrics["Year"] == selected_year)]
+    if level == "Pair":
+        label = (
+            metrics["Origin"].astype(str) + " → " + metrics["Destination"].astype(str)
+        )
+    else:
+        label = metrics[level].astype(str)
+    growth = (
+        metrics.assign(Name=label)[
+            [
+                "Name",
+                "Migration",
+                "Change since 1990",
+                "Growth rate since 1990",
+                "Share",
+            ]
+        ]
+        .dropna(subset=["Change since 1990"])
+        .nlargest(n, "Change since 1990")
+    )
+
+    alt = altair()
+    _reset_chart_names()
+    bars = (
+        alt.Chart(growth)
+        .mark_bar()
+        .encode(
+            x=alt.X(
+                "Change since 1990:Q", title=f"Change in migrants, 1990-{selected_year}"
+            ),
+            y=alt.Y("Name:N", sort="-x", title=None, axis=alt.Axis(labelLimit=200)),
+            color=alt.Color(
+                "Growth rate since 1990:Q",
+                scale=alt.Scale(scheme="blueorange", domainMid=0),
+                legend=alt.Legend(title="Annual growth", format="%"),
+            ),
+            tooltip=[
+                alt.Tooltip("Name:N", title=level),
+                alt.Tooltip(
+                    "Migration:Q", title=f"Migrants in {selected_year}", format=","
+                ),
+                alt.Tooltip("Change since 1990:Q", format=","),
+                alt.Tooltip(
+                    "Growth rate since 1990:Q", title="Annual growth", format=".2%"
+                ),
+                alt.Tooltip("Share:Q", title="Share of total", format=".2%"),
+            ],
+        )
+        .properties(width=600, height=350)
+    )
+    with tracing.stage("to_dict"):
+        return bars.to_dict(format="vega")
+
+
+def flow_vs_stock(selected_year=1990, comparison=None):
+    """
+    Generates a scatter plot of the net migration flow of each country against the change
+    of its migrant stock, over the five years starting with the selected year.
+
+    Countries where the reported flows account for the change of the stock lie on the
+    dashed diagonal. The comparison is computed by flow_stock_comparison, which joins the
+    cached flow totals to the migration stock by location code.
+
+    Args:
+        selected_year (int): The first year of the period (1990, 1995, 2000 or 2005).
+                             Defaults to 1990.
+        comparison (pd.DataFrame, optional): The table of flow_stock_comparison, if
+                                             already loaded. Defaults to computing it.
+
+    Returns:
+        dict: The Altair chart specification in Vega format.
+
+    """
+    if comparison is None:
+        comparison = flow_stock_comparison()
+    comparison = comparison[comparison["Year"] == selected_year].dropna(
+        subset=["Net flow", "Stock change"]
+    )
+    comparison = comparison[
+        [
+            "Country",
+            "Period",
+            "Immigrants",
+            "Emigrants",
+            "Net flow",
+            "Stock",
+            "Stock change",
+        ]
+    ].astype({"Country": str, "Immigrants": float, "Emigrants": float})
+    comparison["Net flow"] = comparison["Net flow"].astype(float)
+
+    # Diagonal spanning both axes
+    values = comparison[["Net flow", "Stock change"]].to_numpy()
+    bounds = [values.min(), values.max()] if len(values) else [0, 1]
+    diagonal = pd.DataFrame({"Net flow": bounds, "Stock change": bounds})
+
+    alt = altair()
+    _reset_chart_names()
+    x = alt.X(
+        "Stock change:Q",
+        title=f"Change in migrant stock, {selected_year}-{selected_year + 5}",
+    )
+    y = alt.Y("Net flow:Q", title="Net migration flow (immigrants - emigrants)")
+    points = (
+        alt.Chart(comparison)
+        .mark_circle(size=60, opacity=0.8)
+        .encode(
+            x=x,
+            y=y,
+            tooltip=[
+                alt.Tooltip("Country:N"),
+                alt.Tooltip("Period:N"),
+                alt.Tooltip("Immigrants:Q", format=","),
+                alt.Tooltip("Emigrants:Q", format=","),
+                alt.Tooltip("Net flow:Q", format=","),
+                alt.Tooltip("Stock:Q", title=f"Stock in {selected_year}", format=","),
+                alt.Tooltip("Stock change:Q", format=","),
+            ],
+        )
+    )
+    line = (
+        alt.Chart(diagonal).mark_line(color="gray", strokeDash=[4, 4]).encode(x=x, y=y)
+    )
+    chart = (line + points).properties(width=600, height=400)
+    with tracing.stage("to_dict"):
+        return chart.to_dict(format="vega")
+
+
+# Largest number of rendered specifications kept by chart_spec
+SPEC_CACHE_SIZE = 64
+
+# Rendering switches the global theme, so only one chart is rendered at a time
+_render_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def load_tables():
+    """
+    Loads the cleaned tables used by the charts, once per process.
+
+    Returns:
+        dict: The cleaned 'total_stock', 'sex_stock', 'estimates', 'region_stock',
+              'area_stock' and 'growth' tables, and the flow and stock comparison
+              ('flows').
+    """
+    total_stock = clean_total_stock()
+    return {
+        "total_stock": total_stock,
+        "sex_stock": clean_sex_stock(),
+        "estimates": clean_estimates(),
+        "region_stock": clean_region_stock(),
+        "area_stock": clean_area_stock(),
+        "growth": clean_growth_metrics(),
+        "flows": flow_stock_comparison(clean_flow_totals(), total_stock),
+    }
+
+
+@functools.lru_cache(maxsize=len(AGGREGATE_LEVELS))
+def grouped_region_stock(grouping):
+    """
+    Returns the regional stock with origins grouped by an aggregate level, once per process.
+
+    Args:
+        grouping (str): One of AGGREGATE_LEVELS.
+
+    Returns:
+        pd.DataFrame: The table of subregion_stock, computed from the loaded tables.
+    """
+    tables = load_tables()
+    if grouping == "SDG region":
+        return tables["region_stock"]
+    return subregion_stock(grouping, area_stock=tables["area_stock"])
+
+
+@functools.lru_cache(maxsize=SPEC_CACHE_SIZE)
+def _cached_spec(chart, year, theme, grouping, lines):
+    tables = load_tables()
+    with _render_lock, altair().themes.enable(theme):
+        if chart == "flow":
+            max_lines, min_migrants = lines
+            specs = migration_flow_all(
+                years=[year],
+                max_lines=max_lines,
+                min_migrants=min_migrants,
+                total_stock=tables["total_stock"],
+                sex_stock=tables["sex_stock"],
+            )
+        elif chart == "rate":
+            specs = migration_rate_all(
+                years=[year],
+                estimates=tables["estimates"],
+                region_stock=grouped_region_stock(grouping),
+            )
+        elif chart == "growth":
+            specs = {year: migration_growth(year, metrics=tables["growth"])}
+        elif chart == "flows":
+            specs = {year: flow_vs_stock(year, comparison=tables["flows"])}
+        else:
+            raise ValueError(
+                f"Unknown chart {chart!r}, expected 'flow', 'rate', 'growth' or 'flows'"
+            )
+    return specs[year]
+
+
+def chart_spec(
+    chart,
+    year,
+    theme="custom_theme",
+    grouping="SDG region",
+    max_lines=None,
+    min_migrants=None,
+):
+    """
+    Returns a chart specification from a size-bounded cache of rendered charts.
+
+    Specifications are kept for the most recently used combinations of arguments, up to
+    SPEC_CACHE_SIZE; older ones are evicted. The tables are loaded
+    once with load_tables and regrouped in memory, so a cache miss only builds the chart.
+
+    Args:
+        chart (str): 'flow' for migration_flow, 'rate' for migration_rate, 'growth' for
+                     migration_growth or 'flows' for flow_vs_stock.
+        year (int): The year to render.
+        theme (str): The name of a registered Altair theme. Defaults to 'custom_theme'.
+        grouping (str): The aggregate level of the origins in the rate chart, one of
+                        AGGREGATE_LEVELS. Defaults to 'SDG region'.
+        max_lines (int, optional): The largest number of connection lines per destination
+                                   in the flow chart.
+        min_migrants (int, optional): The smallest migrant stock drawn as a connection
+                                      line in the flow chart.
+
+    Returns:
+        dict: A copy of the Altair chart specification in Vega format.
+    """
+    # Arguments that a chart ignores are left out of the cache key, so they do not
+    # render it again: only the rate chart is grouped, and only the flow chart has lines
+    grouping = grouping if chart == "rate" else None
+    lines = (max_lines, min_migrants) if chart == "flow" else (None, None)
+    return copy.deepcopy(_cached_spec(chart, year, theme, grouping, lines))
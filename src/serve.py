@@ -0,0 +1,83 @@
+import argparse
+from clean import AGGREGATE_LEVELS
+from plots import YEARS, chart_spec, load_tables
+import panel as pn
+
+# Live version of the chart pages, served with:
+#     panel serve src/serve.py --warm
+# The cleaned tables are loaded when the server starts and rendered charts are kept in
+# an LRU cache shared by every session. Options of the app follow --args, e.g.:
+#     panel serve src/serve.py --warm --args --max-lines 20
+
+parser = argparse.ArgumentParser(prog="serve.py")
+parser.add_argument(
+    "--max-lines",
+    type=int,
+    metavar="N",
+    help="Draw at most N connection lines per country in the flow chart.",
+)
+parser.add_argument(
+    "--min-migrants",
+    type=int,
+    metavar="N",
+    help="Draw connection lines in the flow chart only for at least N migrants.",
+)
+options, _ = parser.parse_known_args()
+
+pn.extension("vega")
+
+load_tables()
+
+select = pn.widgets.Select(name="Year", options=YEARS)
+grouping = pn.widgets.Select(
+    name="Origins grouped by", options=AGGREGATE_LEVELS, value="SDG region"
+)
+
+# Plots Country Page
+plots_country = pn.Column(
+    select,
+    pn.bind(
+        lambda selected_year: chart_spec(
+            "flow",
+            selected_year,
+            max_lines=options.max_lines,
+            min_migrants=options.min_migrants,
+        ),
+        select,
+    ),
+)
+
+# Plots Region Page
+select_row = pn.Row(pn.Spacer(width=600), grouping, select, sizing_mode="stretch_width")
+plots_region = pn.Column(
+    select_row,
+    pn.bind(
+        lambda selected_year, selected_grouping: chart_spec(
+            "rate", selected_year, grouping=selected_grouping
+        ),
+        select,
+        grouping,
+    ),
+)
+
+# Plots Growth Page (changes since 1990, so from the next year on)
+select_growth = pn.widgets.Select(name="Year", options=YEARS[1:], value=YEARS[-1])
+plots_growth = pn.Column(
+    select_growth,
+    pn.bind(lambda selected_year: chart_spec("growth", selected_year), select_growth),
+)
+
+# Plots Flows Page (periods with reported flows)
+periods = sorted(int(year) for year in load_tables()["flows"]["Year"].unique())
+select_period = pn.widgets.Select(name="Period starting", options=periods)
+plots_flows = pn.Column(
+    select_period,
+    pn.bind(lambda selected_year: chart_spec("flows", selected_year), select_period),
+)
+
+pn.Tabs(
+    ("By country", plots_country),
+    ("By region", plots_region),
+    ("Growth since 1990", plots_growth),
+    ("Flows and stock", plots_flows),
+).servable(title="Migration in Motion")
@@ -0,0 +1,322 @@
+import numpy as np
+import pandas as pd
+
+from clean import OTHER_ORIGIN, clean_total_stock, compact_table, country_index
+
+
+class StockTensor:
+    """
+    Migration stock stored as a dense array of shape (years, destinations, origins).
+
+    Destinations and origins are indexed by their position in the sorted numeric codes of
+    country-coord.csv (origins also include code 2003, "Other"), and names are kept once
+    per code instead of on every row. Totals, columns and top-N selections are computed
+    on slices of the array; the long DataFrame is only produced on demand.
+
+    Attributes:
+        values (np.ndarray): Migration stock, NaN where the data has no value.
+        years (np.ndarray): The year of each entry along the first axis.
+        destination_codes (np.ndarray): The numeric code of each destination.
+        origin_codes (np.ndarray): The numeric code of each origin.
+        destination_names (pd.Index): The name of each destination.
+        origin_names (pd.Index): The name of each origin.
+        present (np.ndarray): Whether each destination/origin pair appears in the data.
+        dtype: The dtype of the migration stock in the long format, used for the tables
+               produced from the tensor.
+    """
+
+    def __init__(
+        self,
+        values,
+        years,
+        destination_codes,
+        origin_codes,
+        destination_names,
+        origin_names,
+        present,
+        dtype="float64",
+    ):
+        self.values = values
+        self.years = np.asarray(years)
+        self.destination_codes = np.asarray(destination_codes)
+        self.origin_codes = np.asarray(origin_codes)
+        self.destination_names = pd.Index(destination_names)
+        self.origin_names = pd.Index(origin_names)
+        self.present = present
+        self.dtype = dtype
+
+        # Lookup arrays from numeric code to position along each axis
+        size = max(self.destination_codes.max(), self.origin_codes.max()) + 1
+        self._destination_ids = np.full(size, -1)
+        self._destination_ids[self.destination_codes] = np.arange(
+            len(self.destination_codes)
+        )
+        self._origin_ids = np.full(size, -1)
+        self._origin_ids[self.origin_codes] = np.arange(len(self.origin_codes))
+
+    @staticmethod
+    def _positions(ids, codes, axis):
+        """
+        Looks up the positions of numeric codes along one axis.
+
+        Raises:
+            ValueError: If a code has no position along the axis, e.g. a region code.
+        """
+        codes = np.asarray(codes, dtype=int)
+        known = (codes >= 0) & (codes < len(ids))
+        positions = np.full(len(codes), -1)
+        positions[known] = ids[codes[known]]
+        if (positions < 0).any():
+            unknown = np.unique(codes[positions < 0]).tolist()
+            raise ValueError(f"Unknown {axis} codes {unknown}")
+        return positions
+
+    @classmethod
+    def from_long(cls, total_stock, value="Migration"):
+        """
+        Builds the tensor from the long format produced by clean_total_stock.
+
+        Args:
+            total_stock (pd.DataFrame): Migration stock with the columns 'Destination',
+                                        'Destination code', 'Origin', 'Origin code', 'Year'
+                                        and the value column.
+            value (str): The column holding the migration stock. Defaults to 'Migration'.
+
+        Returns:
+            StockTensor: The dense representation of the data.
+
+        Raises:
+            ValueError: If the data has destination or origin codes that are not in
+                        country-coord.csv (or 2003, "Other"), such as region codes.
+        """
+        countries = country_index()
+        names = pd.Series(countries.names, index=countries.codes).sort_index()
+
+        # Prefer the names used by the stock data, fall back on country-coord.csv
+        destination_names = names.copy()
+        destination_names.update(
+            total_stock.drop_duplicates("Destination code").set_index(
+                "Destination code"
+            )["Destination"]
+        )
+        origin_names = pd.concat([names, pd.Series(["Other"], index=[OTHER_ORIGIN])])
+        origin_names.update(
+            total_stock.drop_duplicates("Origin code").set_index("Origin code")[
+                "Origin"
+            ]
+        )
+
+        years = np.sort(total_stock["Year"].unique())
+        tensor = cls(
+            np.full((len(years), len(destination_names), len(origin_names)), np.nan),
+            years,
+            destination_names.index.astype(total_stock["Destination code"].dtype),
+            origin_names.index.astype(total_stock["Origin code"].dtype),
+            destination_names.to_numpy(),
+            origin_names.to_numpy(),
+            np.zeros((len(destination_names), len(origin_names)), dtype=bool),
+            dtype=total_stock[value].dtype,
+        )
+
+        year_ids = np.searchsorted(years, total_stock["Year"].to_numpy())
+        destination_ids = cls._positions(
+            tensor._destination_ids, total_stock["Destination code"], "destination"
+        )
+        origin_ids = cls._positions(
+            tensor._origin_ids, total_stock["Origin code"], "origin"
+        )
+        tensor.values[year_ids, destination_ids, origin_ids] = total_stock[
+            value
+        ].to_numpy(dtype=float, na_value=np.nan)
+        tensor.present[destination_ids, origin_ids] = True
+        return tensor
+
+    def _year(self, year):
+        """Returns the position of a year along the first axis."""
+        position = np.searchsorted(self.years, year)
+        if position == len(self.years) or self.years[position] != year:
+            raise KeyError(f"No migration stock data for year {year}")
+        return position
+
+    def _destination(self, code):
+        """Returns the position of a destination code along the second axis."""
+        if code >= len(self._destination_ids) or self._destination_ids[code] < 0:
+            raise KeyError(f"Unknown destination code {code}")
+        return self._destination_ids[code]
+
+    def _origins(self, exclude_other):
+        """Returns a mask of the origins to include along the third axis."""
+        if exclude_other:
+            return self.origin_codes != OTHER_ORIGIN
+        return np.ones(len(self.origin_codes), dtype=bool)
+
+    def totals(self, year, exclude_other=False):
+        """
+        Computes the total immigrants of every destination in a year (row sums).
+
+        Args:
+            year (int): The year to compute totals for.
+            exclude_other (bool): Whether to leave out origin code 2003 ("Other").
+                                  Defaults to False.
+
+        Returns:
+            pd.Series: Total immigrants indexed by destination code.
+        """
+        values = self.values[self._year(year)][:, self._origins(exclude_other)]
+        return pd.Series(
+            np.nansum(values, axis=1),
+            index=pd.Index(self.destination_codes, name="Destination code"),
+            name="Migrants",
+        )
+
+    def all_totals(self, exclude_other=False, name="Immigrants"):
+        """
+        Computes the total immigrants of every destination in every year.
+
+        Only the destinations that appear in the data are included, and a destination
+        whose values are all missing in a year gets 0, as with a groupby sum of the long
+        format.
+
+        Args:
+            exclude_other (bool): Whether to leave out origin code 2003 ("Other").
+                                  Defaults to False.
+            name (str): The name of the column of totals. Defaults to 'Immigrants'.
+
+        Returns:
+            pd.DataFrame: One row per year and destination with the columns 'Year',
+                          'Destination code' and the totals, sorted by year and
+                          destination code.
+        """
+        origins = self._origins(exclude_other)
+        destinations = np.flatnonzero(self.present[:, origins].any(axis=1))
+        sums = np.nansum(self.values[:, destinations][:, :, origins], axis=2)
+        return pd.DataFrame(
+            {
+                "Year": np.repeat(self.years, len(destinations)),
+                "Destination code": np.tile(
+                    self.destination_codes[destinations], len(self.years)
+                ),
+                name: pd.array(sums.ravel()).astype(self.dtype),
+            }
+        )
+
+    def destination(self, code, year=None):
+        """
+        Returns the migration stock from every origin into one destination.
+
+        Args:
+            code (int): The numeric code of the destination.
+            year (int, optional): The year to select. Defaults to all years.
+
+        Returns:
+            pd.Series or pd.DataFrame: Migration stock indexed by origin code, for one year,
+                                       or with one column per year.
+        """
+        index = pd.Index(self.origin_codes, name="Origin code")
+        if year is not None:
+            return pd.Series(
+                self.values[self._year(year), self._destination(code)],
+                index=index,
+                name=year,
+            )
+        return pd.DataFrame(
+            self.values[:, self._destination(code)].T, index=index, columns=self.years
+        )
+
+    def top_origins(self, code, year, n=5):
+        """
+        Selects the n origins with the largest migration stock into one destination.
+
+        Args:
+            code (int): The numeric code of the destination.
+            year (int): The year to select.
+            n (int): The number of origins to keep. Defaults to 5.
+
+        Returns:
+            pd.Series: Migration stock of the top origins indexed by origin code, in
+                       descending order.
+        """
+        row = self.values[self._year(year), self._destination(code)]
+        row = np.where(np.isnan(row), -np.inf, row)
+        n = min(n, np.isfinite(row).sum())
+        top = np.argpartition(-row, n - 1)[:n] if n > 0 else np.array([], dtype=int)
+        top = top[np.argsort(-row[top], kind="stable")]
+        return pd.Series(
+            row[top],
+            index=pd.Index(self.origin_codes[top], name="Origin code"),
+            name="Migration",
+        )
+
+    def all_top_origins(self, n=5, exclude_other=False, name="Immigrants"):
+        """
+        Selects the n origins with the largest migration stock into every destination,
+        for every year.
+
+        Each row of the array is sorted once, so ties keep the order of the origin codes,
+        as with top_n on the long format.
+
+        Args:
+            n (int): The number of origins to keep per destination and year. Defaults to 5.
+            exclude_other (bool): Whether to leave out origin code 2003 ("Other").
+                                  Defaults to False.
+            name (str): The name of the column of migration stock. Defaults to 'Immigrants'.
+
+        Returns:
+            pd.DataFrame: The columns 'Year', 'Origin code', 'Destination code' and the
+                          migration stock, ordered by year, destination and then by
+                          descending value.
+        """
+        origins = self._origins(exclude_other)
+        origin_codes = self.origin_codes[origins]
+        values = self.values[:, :, origins]
+        values = np.where(np.isnan(values), -np.inf, values)
+        top = np.argsort(-values, axis=2, kind="stable")[:, :, :n]
+        top_values = np.take_along_axis(values, top, axis=2)
+        year_ids, destination_ids, ranks = np.nonzero(np.isfinite(top_values))
+        origin_ids = top[year_ids, destination_ids, ranks]
+        return pd.DataFrame(
+            {
+                "Year": self.years[year_ids],
+                "Origin code": origin_codes[origin_ids],
+                "Destination code": self.destination_codes[destination_ids],
+                name: pd.array(top_values[year_ids, destination_ids, ranks]).astype(
+                    self.dtype
+                ),
+            }
+        )
+
+    def to_long(self):
+        """
+        Produces the long format of clean_total_stock from the tensor.
+
+        Returns:
+            pd.DataFrame: Migration stock with the columns 'Destination', 'Destination code',
+                          'Origin', 'Origin code', 'Year' and 'Migration', with the compact
+                          dtypes of the cleaned tables.
+        """
+        destination_ids, origin_ids = np.nonzero(self.present)
+        year_ids = np.repeat(np.arange(len(self.years)), len(destination_ids))
+        destination_ids = np.tile(destination_ids, len(self.years))
+        origin_ids = np.tile(origin_ids, len(self.years))
+        return compact_table(
+            pd.DataFrame(
+                {
+                    "Destination": self.destination_names[destination_ids],
+                    "Destination code": self.destination_codes[destination_ids],
+                    "Origin": self.origin_names[origin_ids],
+                    "Origin code": self.origin_codes[origin_ids],
+                    "Year": self.years[year_ids],
+                    "Migration": self.values[year_ids, destination_ids, origin_ids],
+                }
+            )
+        )
+
+
+def stock_tensor():
+    """
+    Builds the dense migration stock tensor from the cleaned migration stock data.
+
+    Returns:
+        StockTensor: The migration stock by year, destination and origin.
+    """
+    return StockTensor.from_long(clean_total_stock())
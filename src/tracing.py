@@ -0,0 +1,171 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Opt-in tracing of the build stages, enabled with environment variables (which worker
+# processes inherit) or with the --trace and --profile options of pages.py:
+#     MIGRATION_TRACE=trace.jsonl python src/pages.py     # "-" writes to stderr
+#     MIGRATION_PROFILE=profiles python src/pages.py      # a cProfile dump of the build
+# Each stage is written as one JSON line with its duration, row count and change in
+# resident memory. Without these variables, stages cost a dictionary lookup.
+
+TRACE_VARIABLE = "MIGRATION_TRACE"
+PROFILE_VARIABLE = "MIGRATION_PROFILE"
+
+# Stages open in the current thread, to record how they nest
+_open_stages = threading.local()
+_write_lock = threading.Lock()
+
+
+def enable(path="-", profile_dir=None):
+    """
+    Turns tracing on for this process and the worker processes it starts.
+
+    Args:
+        path (str, optional): The JSON lines file to append to, or "-" for stderr.
+                              Defaults to "-"; None leaves stage tracing as it is.
+        profile_dir (str, optional): Directory of the cProfile dumps. Defaults to no
+                                     profiling.
+    """
+    if path is not None:
+        os.environ[TRACE_VARIABLE] = path
+    if profile_dir is not None:
+        os.environ[PROFILE_VARIABLE] = profile_dir
+
+
+def enabled():
+    """Returns whether stages are traced."""
+    return bool(os.environ.get(TRACE_VARIABLE))
+
+
+def resident_memory():
+    """
+    Reads the resident set size of this process.
+
+    The size is read from /proc where available (Linux), else from psutil if it is
+    installed. Otherwise the peak resident size from the resource module is returned,
+    which only grows, so memory released by a stage is not seen.
+
+    Returns:
+        int: The resident memory in bytes, or None where none of these is available
+             (e.g., on Windows without psutil).
+    """
+    try:
+        with open("/proc/self/statm", mode="r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def write(record):
+    """
+    Appends a record to the trace as one JSON line.
+
+    Args:
+        record (dict): The fields of the record.
+    """
+    line = json.dumps(record, default=str) + "\n"
+    path = os.environ.get(TRACE_VARIABLE)
+    with _write_lock:
+        if path == "-":
+            sys.stderr.write(line)
+        else:
+            with open(path, mode="a") as file:
+                file.write(line)
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    Traces a stage of the build.
+
+    The stage yields a dictionary, to which the traced code can add fields, such as the
+    number of rows it produced ('rows'). When tracing is off, the dictionary is discarded.
+
+    Args:
+        name (str): The name of the stage (e.g., 'excel parse' or 'melt').
+        **fields: Fields identifying the stage (e.g., the year of a chart).
+
+    Yields:
+        dict: The fields of the record.
+    """
+    record = dict(fields)
+    if not enabled():
+        yield record
+        return
+
+    stack = getattr(_open_stages, "stack", None)
+    if stack is None:
+        stack = _open_stages.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    rss_before = resident_memory()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        rss_after = resident_memory()
+        write(
+            {
+                "stage": name,
+                "parent": parent,
+                **record,
+                "seconds": round(seconds, 6),
+                "rss": rss_after,
+                "rss_delta": (
+                    rss_after - rss_before if rss_before is not None else None
+                ),
+                "pid": os.getpid(),
+                "time": round(time.time(), 3),
+            }
+        )
+
+
+def profiling():
+    """Returns whether blocks are profiled."""
+    return bool(os.environ.get(PROFILE_VARIABLE))
+
+
+@contextlib.contextmanager
+def profile(name):
+    """
+    Profiles a block with cProfile when a profile directory is set.
+
+    The statistics are saved to <directory>/<name>.prof, for pstats or snakeviz.
+
+    Args:
+        name (str): The name of the dump (e.g., the build target).
+    """
+    directory = os.environ.get(PROFILE_VARIABLE)
+    if not directory:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
@@ -0,0 +1,339 @@
+import clean
+from clean import (
+    OTHER_ORIGIN,
+    YEARS,
+    aggregates_data,
+    cached_table,
+    clean_sex_stock,
+    clean_total_stock,
+    compact_table,
+    countries_data,
+    country_index,
+    iter_stock_rows,
+    read_aggregates,
+    read_stock_table,
+    sex_columns,
+    stock_data,
+)
+import json
+import numpy as np
+import os
+import pandas as pd
+import tracing
+
+# Integrity checks of the migration stock data, run by pages.py before the charts are
+# built. The cleaners coerce what they cannot read to NaN and drop rows whose codes are
+# not in country-coord.csv, so these checks report how much data that affects. Only
+# those two checks need the raw sheet (see stock_anomalies, cached like the cleaned
+# tables); the others are computed on the cleaned tables. Validating again, e.g. with
+# other thresholds, therefore reads the caches instead of the workbook, and with
+# streaming the whole sheet is never held in memory.
+
+# Largest value of each check before the build fails (see validate for their meaning).
+# 'coerced values' is strict: a single cell that is neither a number, empty nor ".."
+# fails the build, since the cleaners would silently turn it into a missing value. Each
+# can be overridden with an environment variable named after the check, e.g.
+# MIGRATION_VALIDATE_NEGATIVE_STOCKS=10, or with pages.py --threshold "negative stocks=10".
+thresholds = {
+    "uncovered migrants": 0.02,
+    "coerced values": 0,
+    "negative stocks": 0,
+    "sex mismatch": 0.001,
+    "year rows shortfall": 0.5,
+    "other origin share": 0.1,
+}
+
+
+THRESHOLD_PREFIX = "MIGRATION_VALIDATE_"
+
+
+class ValidationError(ValueError):
+    """Raised when a check of the data exceeds its threshold."""
+
+
+def threshold_variable(check):
+    """Returns the environment variable that overrides the threshold of a check."""
+    return THRESHOLD_PREFIX + check.upper().replace(" ", "_")
+
+
+def set_threshold(check, value):
+    """
+    Overrides the threshold of a check in this process and the workers it starts.
+
+    Args:
+        check (str): The name of the check, e.g. 'negative stocks'.
+        value (float): The largest value of the check before the build fails.
+
+    Raises:
+        ValueError: If the check is unknown.
+    """
+    if check not in thresholds:
+        raise ValueError(
+            f"Unknown check {check!r}, expected one of {', '.join(thresholds)}"
+        )
+    os.environ[threshold_variable(check)] = str(float(value))
+
+
+def current_thresholds():
+    """
+    Returns the threshold of each check, with the overrides from the environment.
+
+    Returns:
+        dict: The largest value of each check, keyed by check.
+
+    Raises:
+        ValueError: If an override is not a number.
+    """
+    current = {}
+    for check, default in thresholds.items():
+        value = os.environ.get(threshold_variable(check))
+        try:
+            current[check] = default if value is None else float(value)
+        except ValueError:
+            raise ValueError(
+                f"{threshold_variable(check)} must be a number, got {value!r}"
+            ) from None
+    return current
+
+
+def row_anomalies(rows, countries):
+    """
+    Finds the rows of the raw stock sheet that the cleaned tables do not show as they are.
+
+    Args:
+        rows (pd.DataFrame): Rows of the raw sheet between countries or areas.
+        countries (CountryIndex): The countries of country-coord.csv.
+
+    Returns:
+        pd.DataFrame: The rows with a code missing from country-coord.csv or with cells
+                      coerced to NaN (see stock_anomalies).
+    """
+    destinations = rows["Location code of destination"].to_numpy()
+    origins = rows["Location code of origin"].to_numpy()
+    covered = countries.contains(destinations) & (
+        countries.contains(origins) | (origins == OTHER_ORIGIN)
+    )
+
+    # Both sexes, male and female, as one block of shape (rows, 3 x years)
+    columns = YEARS + [column for block in sex_columns().values() for column in block]
+    cells = rows[columns]
+    values = cells.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    coerced = (cells.notna().to_numpy() & np.isnan(values)).sum(axis=1)
+
+    anomalous = ~covered | (coerced > 0)
+    return pd.DataFrame(
+        {
+            "Destination code": destinations[anomalous],
+            "Origin code": origins[anomalous],
+            "Covered": covered[anomalous],
+            "Migrants": np.nansum(values[anomalous, : len(YEARS)], axis=1),
+            "Coerced values": coerced[anomalous],
+        }
+    )
+
+
+@cached_table(lambda: [stock_data, countries_data, aggregates_data])
+def stock_anomalies():
+    """
+    Finds the rows of the raw stock sheet that the cleaners drop or coerce.
+
+    Rows are kept when both destination and origin are countries or areas (listed in
+    country-coord.csv or in the aggregates correspondence table), or when the origin is
+    other or unknown (code 2003). Of these, the rows with a code missing from
+    country-coord.csv, which the cleaners drop, and the rows with cells other than ".."
+    that are not numbers, which the cleaners coerce to NaN, are returned. With streaming
+    set, the sheet is read in chunks of rows instead of parsed at once.
+
+    Returns:
+        pd.DataFrame: One row per anomalous sheet row, with the columns
+                      'Destination code', 'Origin code', 'Covered' (whether the cleaners
+                      keep the row), 'Migrants' (over all years, for both sexes) and
+                      'Coerced values'.
+    """
+    countries = country_index()
+    areas = np.union1d(read_aggregates()["Location code"].to_numpy(), countries.codes)
+    if clean.streaming:
+        chunks = iter_stock_rows(
+            destinations=areas, origins=np.append(areas, OTHER_ORIGIN)
+        )
+    else:
+        raw = read_stock_table()
+        destinations = raw["Location code of destination"].to_numpy()
+        origins = raw["Location code of origin"].to_numpy()
+        keep = np.isin(destinations, areas) & (
+            np.isin(origins, areas) | (origins == OTHER_ORIGIN)
+        )
+        chunks = [raw[keep]]
+    return compact_table(
+        pd.concat(
+            [row_anomalies(rows, countries) for rows in chunks], ignore_index=True
+        )
+    )
+
+
+def validate():
+    """
+    Checks the migration stock data.
+
+    The checks are:
+
+    - 'uncovered migrants': share of the migrants in rows that the cleaners drop because
+      a code is missing from country-coord.csv.
+    - 'coerced values': number of cells, other than "..", that are not numbers.
+    - 'negative stocks': number of negative stocks in the cleaned tables, for both sexes
+      or either sex.
+    - 'sex mismatch': share of the stocks where the male and female stocks do not add up
+      to the stock of both sexes.
+    - 'year rows shortfall': how far the year with the fewest values is below the year with
+      the most (0 when every year has as many).
+    - 'other origin share': largest share of migrants from other or unknown origins in a
+      year, which the flow chart leaves out.
+
+    The first two are computed from the raw sheet by stock_anomalies, and the others from
+    clean_total_stock and clean_sex_stock.
+
+    Returns:
+        pd.DataFrame: One row per check with the columns 'Check', 'Value', 'Threshold',
+                      'Failed' and 'Detail'.
+    """
+    anomalies = stock_anomalies()
+    total_stock = clean_total_stock()
+    sex_stock = clean_sex_stock()
+    keys = ["Destination code", "Origin code", "Year"]
+
+    # Coverage of the codes
+    countries = country_index()
+    uncovered = anomalies[~anomalies["Covered"]]
+    migrants = total_stock["Migration"].sum() + uncovered["Migrants"].sum()
+    uncovered_share = uncovered["Migrants"].sum() / migrants if migrants else 0.0
+    destinations = uncovered["Destination code"].to_numpy()
+    origins = uncovered["Origin code"].to_numpy()
+    uncovered_codes = np.union1d(
+        destinations[~countries.contains(destinations)],
+        origins[~countries.contains(origins) & (origins != OTHER_ORIGIN)],
+    )
+
+    # Negative stocks, and the pairs of countries that have them
+    negative = pd.concat(
+        [
+            total_stock.loc[total_stock["Migration"] < 0, keys],
+            sex_stock.loc[sex_stock["Migration"] < 0, keys],
+        ]
+    )
+
+    # Sexes adding up to the total
+    sexes = total_stock[keys + ["Migration"]]
+    for sex in ["Male", "Female"]:
+        sexes = sexes.merge(
+            sex_stock.loc[sex_stock["Sex"] == sex, keys + ["Migration"]].rename(
+                columns={"Migration": sex}
+            ),
+            on=keys,
+            how="left",
+        )
+    complete = sexes[["Migration", "Male", "Female"]].notna().all(axis=1)
+    mismatch = complete & (
+        (sexes["Male"] + sexes["Female"] - sexes["Migration"]).abs() >= 1
+    )
+    mismatch_share = mismatch.sum() / complete.sum() if complete.any() else 0.0
+
+    # Values per year, and migrants from other or unknown origins
+    year_rows = (
+        total_stock["Migration"]
+        .notna()
+        .groupby(total_stock["Year"])
+        .sum()
+        .reindex(YEARS, fill_value=0)
+        .to_numpy()
+    )
+    shortfall = 1 - year_rows.min() / year_rows.max() if year_rows.max() else 0.0
+    year_totals = (
+        total_stock.groupby("Year")["Migration"]
+        .sum()
+        .reindex(YEARS, fill_value=0)
+        .to_numpy(dtype=float)
+    )
+    other = total_stock[total_stock["Origin code"] == OTHER_ORIGIN]
+    other_totals = (
+        other.groupby("Year")["Migration"]
+        .sum()
+        .reindex(YEARS, fill_value=0)
+        .to_numpy(dtype=float)
+    )
+    other_shares = np.divide(
+        other_totals,
+        year_totals,
+        out=np.zeros_like(year_totals),
+        where=year_totals > 0,
+    )
+
+    checks = [
+        (
+            "uncovered migrants",
+            uncovered_share,
+            f"{len(uncovered_codes)} codes: {uncovered_codes.tolist()}",
+        ),
+        (
+            "coerced values",
+            anomalies["Coerced values"].sum(),
+            f"{(anomalies['Coerced values'] > 0).sum()} rows",
+        ),
+        (
+            "negative stocks",
+            len(negative),
+            f"{len(negative.drop_duplicates(keys[:2]))} rows",
+        ),
+        (
+            "sex mismatch",
+            mismatch_share,
+            f"{mismatch.sum()} of {complete.sum()} cells",
+        ),
+        (
+            "year rows shortfall",
+            shortfall,
+            ", ".join(f"{year}: {rows}" for year, rows in zip(YEARS, year_rows)),
+        ),
+        (
+            "other origin share",
+            other_shares.max(),
+            f"largest in {YEARS[other_shares.argmax()]}",
+        ),
+    ]
+    report = pd.DataFrame(checks, columns=["Check", "Value", "Detail"])
+    report["Value"] = report["Value"].astype(float)
+    report.insert(
+        2, "Threshold", report["Check"].map(current_thresholds()).astype(float)
+    )
+    report.insert(3, "Failed", report["Value"] > report["Threshold"])
+    return report
+
+
+def save_report(path):
+    """
+    Validates the data, saves the report as JSON and fails if a check exceeds its threshold.
+
+    The report is saved before failing, so the anomalies can be looked up in it.
+
+    Args:
+        path (str): Location of the JSON file.
+
+    Returns:
+        list: The files written.
+
+    Raises:
+        ValidationError: If any check exceeds its threshold.
+    """
+    with tracing.stage("validate") as record:
+        report = validate()
+        record["failed"] = int(report["Failed"].sum())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as file:
+        json.dump(report.to_dict(orient="records"), file, indent=2)
+
+    failed = report[report["Failed"]]
+    if len(failed):
+        raise ValidationError(
+            f"{len(failed)} data checks failed (report in {path}):\n"
+            + failed.to_string(index=False)
+        )
+    return [path]
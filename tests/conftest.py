@@ -0,0 +1,171 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo_dir, "src"))
+
+# The modules read their folders from the environment when they are imported, so the
+# tests point them at a temporary folder before any test module imports them. The stock
+# and estimates workbooks are not in the repository, so smaller synthetic ones with the
+# same layout are written there; the other data files are copied from data/.
+test_dir = tempfile.mkdtemp(prefix="migration-tests-")
+os.environ["MIGRATION_DATA_DIR"] = os.path.join(test_dir, "data")
+os.environ["MIGRATION_CACHE_DIR"] = os.path.join(test_dir, "cache")
+os.environ["MIGRATION_WWW_DIR"] = os.path.join(test_dir, "www")
+os.environ.pop("MIGRATION_STREAM", None)
+
+YEARS = [1990, 1995, 2000, 2005, 2010, 2015, 2020]
+
+
+def write_stock_workbook(path, rng, destinations=40, origins=20):
+    """
+    Writes a stock workbook laid out like the UN DESA one (sheet "Table 1").
+
+    It has rows between regions, which the cleaners leave out, then rows from random
+    origins (and code 2003, "Other") into random destinations of country-coord.csv, with
+    ".." for about 5% of the values. Male and female stocks add up to the stock of both
+    sexes.
+    """
+    from openpyxl import Workbook
+
+    countries = pd.read_csv(os.path.join(repo_dir, "data", "country-coord.csv"))
+    codes = countries["Numeric code"].astype(int).to_numpy()
+    names = dict(zip(codes, countries["Country"]))
+    regions = [
+        (900, "WORLD"),
+        (903, "AFRICA"),
+        (935, "ASIA"),
+        (908, "EUROPE"),
+        (904, "LATIN AMERICA AND THE CARIBBEAN"),
+        (905, "NORTHERN AMERICA"),
+        (909, "OCEANIA"),
+    ]
+
+    workbook = Workbook()
+    workbook.active.title = "Table of contents"
+    sheet = workbook.create_sheet("Table 1")
+    for _ in range(10):
+        sheet.append([None])
+    sheet.append(
+        [
+            "Index",
+            "Region, development group, country or area of destination",
+            "Notes of destination",
+            "Location code of destination",
+            "Type of data of destination",
+            "Region, development group, country or area of origin",
+            "Location code of origin",
+        ]
+        + YEARS * 3
+    )
+
+    def values(low, high, missing=0.0):
+        total = rng.integers(low, high, len(YEARS))
+        male = total // 2
+        row = [int(value) for value in np.concatenate([total, male, total - male])]
+        return [".." if rng.random() < missing else value for value in row]
+
+    index = 1
+    for destination, destination_name in regions:
+        for origin, origin_name in regions:
+            sheet.append(
+                [index, destination_name, None, destination, None, origin_name, origin]
+                + values(1000, 10**6)
+            )
+            index += 1
+    for destination in rng.choice(codes, destinations, replace=False):
+        for origin in list(rng.choice(codes, origins, replace=False)) + [2003]:
+            if origin == destination:
+                continue
+            sheet.append(
+                [
+                    index,
+                    names[destination],
+                    None,
+                    int(destination),
+                    "B",
+                    names.get(origin, "Other"),
+                    int(origin),
+                ]
+                + values(0, 10**5, missing=0.05)
+            )
+            index += 1
+    workbook.save(path)
+
+
+def write_estimates_workbook(path, rng):
+    """Writes a population estimates workbook laid out like the WPP one ("Estimates")."""
+    from openpyxl import Workbook
+
+    regions = {
+        1834: "Central and Southern Asia",
+        1833: "Northern Africa and Western Asia",
+        1831: "Sub-Saharan Africa",
+        1832: "Eastern and South-Eastern Asia",
+        1830: "Latin America and the Caribbean",
+        1835: "Oceania (excluding Australia and New Zealand)",
+        1836: "Australia/New Zealand",
+        1829: "Europe and Northern America",
+    }
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "Estimates"
+    for _ in range(16):
+        sheet.append([None])
+    sheet.append(
+        [
+            "Index",
+            "Variant",
+            "Region, subregion, country or area *",
+            "Notes",
+            "Location code",
+            "Type",
+            "Parent code",
+            "Year",
+            "Net Migration Rate (per 1,000 population)",
+        ]
+    )
+    index = 1
+    for code, name in list(regions.items()) + [(900, "World")]:
+        for year in range(1950, 2024):
+            sheet.append(
+                [
+                    index,
+                    "Estimates",
+                    name,
+                    None,
+                    code,
+                    "World" if code == 900 else "SDG region",
+                    1828,
+                    year,
+                    float(rng.normal()),
+                ]
+            )
+            index += 1
+    workbook.save(path)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def data_files():
+    """Writes the data files of the tests once, and removes the folder at the end."""
+    import clean
+
+    data_dir = os.environ["MIGRATION_DATA_DIR"]
+    os.makedirs(data_dir, exist_ok=True)
+    for filename in [
+        "country-coord.csv",
+        "aggregates_correspondence_table_2020_1.xlsx",
+        "undesa_pd_2015_migration_flow_totals.xlsx",
+    ]:
+        shutil.copy(os.path.join(repo_dir, "data", filename), data_dir)
+    rng = np.random.default_rng(0)
+    write_stock_workbook(clean.stock_data, rng)
+    write_estimates_workbook(clean.estimates_data, rng)
+    yield data_dir
+    shutil.rmtree(test_dir, ignore_errors=True)
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import pages
+import validate
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    """Redirects the pages, specifications and manifest of the build to a folder."""
+
+    def redirect(name):
+        directory = tmp_path / name
+        monkeypatch.setattr(pages, "www_dir", str(directory / "www"))
+        monkeypatch.setattr(pages, "shared_data_dir", str(directory / "www" / "data"))
+        monkeypatch.setattr(pages, "vendor_dir", str(directory / "www" / "vendor"))
+        monkeypatch.setattr(pages, "specs_dir", str(directory / "specs"))
+        monkeypatch.setattr(
+            pages, "manifest_path", str(directory / "build-manifest.json")
+        )
+        return directory
+
+    return redirect
+
+
+def read_specs(directory):
+    """Reads the saved specifications, with the datasets of each keyed by name."""
+
+    def by_name(spec):
+        if isinstance(spec.get("data"), list):
+            spec["data"] = {dataset["name"]: dataset for dataset in spec["data"]}
+        return spec
+
+    # VegaFusion does not list the datasets it inlines in a fixed order
+    return {
+        name: json.loads(
+            (directory / "specs" / f"{name}.json").read_text(), object_hook=by_name
+        )
+        for name in ["flow", "rate"]
+    }
+
+
+@pytest.mark.parametrize("single_spec", [False, True], ids=["per-year", "single"])
+def test_parallel_build_matches_serial(build_dir, monkeypatch, single_spec):
+    monkeypatch.setattr(pages, "single_spec", single_spec)
+    serial = build_dir("serial")
+    pages.build(["country", "region"], jobs=1)
+    parallel = build_dir("parallel")
+    pages.build(["country", "region"], jobs=2)
+
+    assert read_specs(parallel) == read_specs(serial)
+    for page in ["plots_country.html", "plots_region.html"]:
+        assert (parallel / "www" / page).exists()
+
+
+def test_build_skips_targets_that_are_up_to_date(build_dir, monkeypatch):
+    build_dir("build")
+    assert set(pages.build(["country", "region"])) == {
+        "validation",
+        "flow-specs",
+        "rate-specs",
+        "country",
+        "region",
+    }
+    assert pages.build(["country", "region"]) == []
+
+    # A mode only rebuilds the targets whose output it changes
+    monkeypatch.setattr(pages, "single_spec", True)
+    assert set(pages.build(["country", "region"])) == {
+        "flow-specs",
+        "rate-specs",
+        "country",
+        "region",
+    }
+    monkeypatch.setattr(pages, "max_lines", 3)
+    assert set(pages.build(["country", "region"])) == {"flow-specs", "country"}
+
+    monkeypatch.setenv(validate.threshold_variable("sex mismatch"), "0.5")
+    assert "validation" in pages.build(["country", "region"])
+
+
+def test_missing_output_is_rebuilt(build_dir):
+    directory = build_dir("build")
+    pages.build(["region"])
+    (directory / "www" / "plots_region.html").unlink()
+    assert pages.build(["region"]) == ["region"]
@@ -0,0 +1,113 @@
+import importlib
+import os
+
+import pandas as pd
+import pytest
+
+import clean
+import validate
+
+
+@pytest.mark.parametrize(
+    "cleaner",
+    [clean.clean_total_stock, clean.clean_sex_stock, clean.clean_area_stock],
+    ids=lambda cleaner: cleaner.__name__,
+)
+def test_streamed_tables_match_parsed(cleaner, monkeypatch):
+    monkeypatch.setattr(clean, "streaming", False)
+    parsed = cleaner.uncached()
+    monkeypatch.setattr(clean, "streaming", True)
+    streamed = cleaner.uncached()
+    pd.testing.assert_frame_equal(streamed, parsed)
+
+
+def test_streamed_validation_matches_parsed(monkeypatch):
+    monkeypatch.setattr(clean, "streaming", False)
+    parsed = validate.stock_anomalies.uncached()
+    monkeypatch.setattr(clean, "streaming", True)
+    streamed = validate.stock_anomalies.uncached()
+    pd.testing.assert_frame_equal(streamed, parsed)
+
+
+def test_small_chunks_match_parsed(monkeypatch):
+    monkeypatch.setattr(clean, "streaming", False)
+    parsed = clean.clean_total_stock.uncached()
+    streamed = clean.stream_total_stock(chunksize=7)
+    pd.testing.assert_frame_equal(streamed, parsed)
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """A source file and an empty cache folder for a cached table."""
+    monkeypatch.setattr(clean, "cache_dir", str(tmp_path / "cache"))
+    path = tmp_path / "lines.txt"
+    path.write_text("a\nb\n")
+    return path
+
+
+def cached_lines(path, calls, version=1):
+    @clean.cached_table(lambda: [str(path)], version=version)
+    def lines():
+        calls.append(path.read_text())
+        return pd.DataFrame({"Line": path.read_text().splitlines()})
+
+    return lines
+
+
+def cache_files():
+    return sorted(os.listdir(clean.cache_dir))
+
+
+def test_cached_table_is_read_back(source):
+    calls = []
+    lines = cached_lines(source, calls)
+    first = lines()
+    second = lines()
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+    assert len(cache_files()) == 1
+
+
+def test_changed_source_invalidates_cache(source):
+    calls = []
+    lines = cached_lines(source, calls)
+    lines()
+    stale = cache_files()
+
+    source.write_text("a\nb\nc\n")
+    assert lines()["Line"].tolist() == ["a", "b", "c"]
+    assert len(calls) == 2
+    # The file of the old fingerprint is replaced
+    assert len(cache_files()) == 1 and cache_files() != stale
+
+
+def test_version_invalidates_cache(source):
+    calls = []
+    cached_lines(source, calls)()
+    cached_lines(source, calls, version=2)()
+    assert len(calls) == 2
+
+
+def test_changed_helper_invalidates_cache(source, tmp_path, monkeypatch):
+    # The fingerprint covers the source of the cleaner's whole module, so a change to a
+    # helper it calls is not served from the cache either
+    module = tmp_path / "cleaners.py"
+    template = (
+        "import clean\n"
+        "import pandas as pd\n"
+        "\n"
+        "def helper():\n"
+        "    return {value}\n"
+        "\n"
+        "@clean.cached_table(lambda: [{path!r}])\n"
+        "def cleaner():\n"
+        "    return pd.DataFrame({{'Value': [helper()]}})\n"
+    )
+    module.write_text(template.format(value=1, path=str(source)))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    cleaners = importlib.import_module("cleaners")
+    assert cleaners.cleaner()["Value"].tolist() == [1]
+
+    module.write_text(template.format(value=20, path=str(source)))
+    cleaners = importlib.reload(cleaners)
+    assert cleaners.cleaner()["Value"].tolist() == [20]
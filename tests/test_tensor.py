@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from clean import OTHER_ORIGIN, clean_total_stock, top_n
+from tensor import StockTensor
+
+
+@pytest.fixture(scope="module")
+def total_stock():
+    return clean_total_stock()
+
+
+def test_to_long_matches_cleaned_table(total_stock):
+    long = StockTensor.from_long(total_stock).to_long()
+    keys = ["Year", "Destination code", "Origin code"]
+    assert long.dtypes.equals(total_stock.dtypes)
+    pd.testing.assert_frame_equal(
+        long.sort_values(keys, ignore_index=True),
+        total_stock.sort_values(keys, ignore_index=True),
+        check_categorical=False,
+    )
+
+
+def test_totals_and_top_origins_match_groupby(total_stock):
+    stock = total_stock[total_stock["Origin code"] != OTHER_ORIGIN]
+    tensor = StockTensor.from_long(stock)
+
+    totals = stock.groupby(["Year", "Destination code"], as_index=False).agg(
+        Immigrants=("Migration", "sum")
+    )
+    pd.testing.assert_frame_equal(tensor.all_totals(), totals)
+
+    pairs = stock.groupby(["Year", "Origin code", "Destination code"]).agg(
+        Immigrants=("Migration", "sum")
+    )
+    top = top_n(pairs.reset_index(), ["Year", "Destination code"], "Immigrants", n=5)
+    pd.testing.assert_frame_equal(tensor.all_top_origins(n=5), top)
+
+
+def test_unknown_codes_are_rejected(total_stock):
+    regions = total_stock.assign(**{"Destination code": 900})
+    with pytest.raises(ValueError, match="900"):
+        StockTensor.from_long(regions)